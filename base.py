@@ -1,4 +1,21 @@
 #-*- coding: UTF-8 -*-
 class Base:
   def __init__(self):
-    pass
\ No newline at end of file
+    pass
+
+  def read_dictionary(self, dict_path=None):
+    """
+    读取每行为"字符 索引"格式的字典文件
+    :param dict_path: 字典路径，为空时使用self.dict_path
+    :return: 字符到索引的字典
+    """
+    if dict_path is None:
+      dict_path = self.dict_path
+    dict_file = open(dict_path, 'r', encoding='utf-8')
+    dict_content = dict_file.read().splitlines()
+    dictionary = {}
+    dict_arr = map(lambda item: item.split(' '), dict_content)
+    for _, dict_item in enumerate(dict_arr):
+      dictionary[dict_item[0]] = int(dict_item[1])
+    dict_file.close()
+    return dictionary
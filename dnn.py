@@ -6,12 +6,15 @@ import numpy as np
 from dnn_base import DNNBase
 from preprocess_data import PreprocessData
 from config import TrainMode
+from export_model import export_inference, load_inference, quantized_variable, dequantize_lookup
+from utils import quantize_rows
 
 
 class DNN(DNNBase):
   def __init__(self, type = 'mlp', batch_size = 10, batch_length = 224,
                mode = TrainMode.Batch, task = 'cws', is_seg = False,
-               is_embed = False):
+               is_embed = False, is_fused = False, is_dataset = False,
+               is_quantized = False, corpus = 'emr_ner'):
     tf.reset_default_graph()
     DNNBase.__init__(self)
     # 参数初始化
@@ -26,8 +29,12 @@ class DNN(DNNBase):
       self.tags = [0, 1, 2, 3]
     elif task == 'ner':
       self.tags = [0, 1, 2]
+    elif task == 'category':
+      # 带实体类别的标签，标签数较多，预测时可以使用束搜索解码
+      self.tags = list(self.category_reverse_dict.keys())
     else:
       raise Exception('task name error')
+    self.task = task
     self.is_embed = is_embed
     self.tags_count = len(self.tags)
     self.concat_embed_size = self.window_size * self.embed_size
@@ -38,19 +45,39 @@ class DNN(DNNBase):
     self.mode = mode
     self.type = type
     self.is_seg = is_seg
+    self.is_fused = is_fused
+    self.is_dataset = is_dataset and not is_seg
     self.dropout_rate = 0.2
-    # 数据初始化
-    pre = PreprocessData('emr_ner', self.mode, force_generate = True)
-    self.character_batches = pre.character_batches
-    self.label_batches = pre.label_batches
-    self.lengths = pre.lengths
-    self.dictionary = pre.dictionary
+    # 预测时embeddings保存为按行量化的int8，查表后再还原为浮点数，只能加载export_inference导出的量化模型
+    self.is_quantized = is_quantized
+    if self.is_quantized and not self.is_seg:
+      raise Exception('quantized model can only be used for prediction')
+    # 数据初始化，预测时只需要字典
+    if self.is_seg:
+      self.character_batches = None
+      self.label_batches = None
+      self.lengths = None
+      self.dictionary = self.read_dictionary('corpus/' + corpus + '_dict.utf8')
+    else:
+      # 已生成的窗口直接读取，使用输入管道时以内存映射方式读取
+      pre = PreprocessData(corpus, self.mode, force_generate = False,
+                           mmap = self.is_dataset)
+      self.character_batches = pre.character_batches
+      self.label_batches = pre.label_batches
+      self.lengths = pre.lengths
+      self.dictionary = pre.dictionary
     self.vocab_size = len(self.dictionary)
     # 模型定义和初始化
     self.sess = tf.Session()
+    if self.is_dataset:
+      self.build_dataset()
 
     initializer = tf.contrib.layers.xavier_initializer(dtype = self.dtype)
-    if not self.is_embed:
+    # 预测时参数从模型文件恢复，不需要读取预训练的词向量
+    if self.is_quantized:
+      self.embeddings, self.embeddings_scale = quantized_variable(
+        [self.vocab_size, self.embed_size], self.dtype, name = 'embeddings')
+    elif not self.is_embed or self.is_seg:
       self.embeddings = tf.Variable(
         tf.truncated_normal([self.vocab_size, self.embed_size],
                             stddev = 1.0 / math.sqrt(self.embed_size),
@@ -60,7 +87,11 @@ class DNN(DNNBase):
     else:
       self.embeddings = tf.Variable(np.load('corpus/embed/embeddings.npy'),
                                     dtype = self.dtype, name = 'embeddings')
-    self.input = tf.placeholder(tf.int32, shape = [None, self.window_size])
+    if self.mode == TrainMode.Sentence:
+      self.input = self.input_holder(0, [None, self.window_size], 'input')
+    else:
+      self.input = tf.placeholder(tf.int32, shape = [None, self.window_size],
+                                  name = 'input')
     self.label_index_correct = tf.placeholder(tf.int32, shape = [None, 2])
     self.label_index_current = tf.placeholder(tf.int32, shape = [None, 2])
     # self.w = tf.Variable(
@@ -77,30 +108,41 @@ class DNN(DNNBase):
     self.transition_init = tf.get_variable('transition_init', [self.tags_count],
                                            dtype = self.dtype,
                                            initializer = initializer)
-    self.transition_holder = tf.placeholder(self.dtype,
-                                            shape = self.transition.get_shape())
-    self.transition_init_holder = tf.placeholder(self.dtype,
-                                                 shape = self.transition_init.get_shape())
-    # self.optimizer = tf.train.GradientDescentOptimizer(self.learning_rate)
-    self.optimizer = tf.train.AdagradOptimizer(0.02)
-    # self.optimizer = tf.train.MomentumOptimizer(0.01,0.9)
-    # self.optimizer = tf.train.AdamOptimizer(0.0001)#,beta1=0.1,beta2=0.001)
-    self.update_transition = self.transition.assign(
-      tf.add((1 - self.learning_rate * self.lam) * self.transition,
-             self.learning_rate * self.transition_holder))
-    self.update_transition_init = self.transition_init.assign(
-      tf.add((1 - self.learning_rate * self.lam) * self.transition_init,
-             self.learning_rate * self.transition_init_holder))
+    # 预测时只构建前向计算图
+    if not self.is_seg:
+      self.transition_holder = tf.placeholder(self.dtype,
+                                              shape = self.transition.get_shape())
+      self.transition_init_holder = tf.placeholder(self.dtype,
+                                                   shape = self.transition_init.get_shape())
+      # self.optimizer = tf.train.GradientDescentOptimizer(self.learning_rate)
+      self.optimizer = tf.train.AdagradOptimizer(0.02)
+      # self.optimizer = tf.train.MomentumOptimizer(0.01,0.9)
+      # self.optimizer = tf.train.AdamOptimizer(0.0001)#,beta1=0.1,beta2=0.001)
+      self.update_transition = self.transition.assign(
+        tf.add((1 - self.learning_rate * self.lam) * self.transition,
+               self.learning_rate * self.transition_holder))
+      self.update_transition_init = self.transition_init.assign(
+        tf.add((1 - self.learning_rate * self.lam) * self.transition_init,
+               self.learning_rate * self.transition_init_holder))
     self.look_up = tf.reshape(
-      tf.nn.embedding_lookup(self.embeddings, self.input),
+      self.embedding_lookup(self.input),
       [-1, self.concat_embed_size])
     self.params = [self.w, self.embeddings]
     if type == 'mlp':
       self.b = tf.Variable(tf.zeros([self.tags_count, 1], dtype = self.dtype),
                            name = 'b')
       self.params.append(self.b)
+      if self.is_seg:
+        # 预测时输入为补齐后的多个句子，所有窗口一起计算分数后每个句子分别解码
+        self.input = tf.placeholder(tf.int32,
+                                    shape = [None, None, self.window_size],
+                                    name = 'batch_input')
+        input_shape = tf.shape(self.input)
+        self.look_up = tf.reshape(
+          self.embedding_lookup(self.input),
+          [-1, self.concat_embed_size])
       self.input_embeds = tf.transpose(
-        tf.reshape(tf.nn.embedding_lookup(self.embeddings, self.input),
+        tf.reshape(self.embedding_lookup(self.input),
                    [-1, self.concat_embed_size]))
       self.hidden_w = tf.Variable(
         tf.random_uniform([self.hidden_units, self.concat_embed_size],
@@ -112,12 +154,26 @@ class DNN(DNNBase):
       self.word_scores = tf.matmul(self.w,
                                    tf.sigmoid(tf.matmul(self.hidden_w,
                                                         self.input_embeds) + self.hidden_b)) + self.b
+      self.word_scores = tf.identity(self.word_scores, name = 'word_scores')
+      if self.is_seg:
+        # 与LSTM一致，batch_scores为tags*length*batch
+        self.batch_scores = tf.transpose(
+          tf.reshape(self.word_scores,
+                     [self.tags_count, input_shape[0], input_shape[1]]),
+          [0, 2, 1])
+        self.batch_scores = tf.identity(self.batch_scores, name = 'batch_scores')
+        self.build_sequence_length(input_shape[0], input_shape[1])
+        self.build_decode(tf.transpose(self.batch_scores, [2, 1, 0]))
+      else:
+        self.build_sequence_length(1, tf.shape(self.input)[0])
+        self.build_decode(tf.expand_dims(tf.transpose(self.word_scores), 0))
       self.params += [self.hidden_w, self.hidden_b]
-      self.loss = tf.reduce_sum(
-        tf.gather_nd(self.word_scores, self.label_index_current) -
-        tf.gather_nd(self.word_scores,
-                     self.label_index_correct)) + tf.contrib.layers.apply_regularization(
-        tf.contrib.layers.l2_regularizer(self.lam), self.params)
+      if not self.is_seg:
+        self.loss = tf.reduce_sum(
+          tf.gather_nd(self.word_scores, self.label_index_current) -
+          tf.gather_nd(self.word_scores,
+                       self.label_index_correct)) + tf.contrib.layers.apply_regularization(
+          tf.contrib.layers.l2_regularizer(self.lam), self.params)
     elif type == 'lstm':
       self.lstm = tf.nn.rnn_cell.BasicLSTMCell(self.hidden_units)
       self.b = tf.Variable(
@@ -125,22 +181,25 @@ class DNN(DNNBase):
       self.params.append(self.b)
       if self.mode == TrainMode.Batch:
         if not self.is_seg:
-          self.input = tf.placeholder(tf.int32, shape = [self.batch_size,
-                                                         self.batch_length,
-                                                         self.window_size])
+          # 句子长度不固定，按长度分桶的batch只补齐到batch内最长句子的长度
+          self.input = self.input_holder(0, [self.batch_size, None,
+                                             self.window_size])
           self.input_embeds = tf.reshape(
-            tf.nn.embedding_lookup(self.embeddings, self.input),
-            [self.batch_size, self.batch_length, self.concat_embed_size])
+            self.embedding_lookup(self.input),
+            [self.batch_size, -1, self.concat_embed_size])
           self.input_embeds = tf.layers.dropout(self.input_embeds,
                                                 self.dropout_rate)
+          self.build_sequence_length(self.batch_size, tf.shape(self.input)[1])
           self.lstm_output, self.lstm_out_state = tf.nn.dynamic_rnn(self.lstm,
                                                                     self.input_embeds,
+                                                                    sequence_length = self.sequence_length,
                                                                     dtype = self.dtype)
           self.params += [v for v in tf.global_variables() if
                           v.name.startswith('rnn')]
           self.word_scores = tf.tensordot(self.w,
                                           tf.transpose(self.lstm_output),
                                           [[1], [0]]) + self.b
+          self.build_decode(tf.transpose(self.word_scores, [2, 1, 0]))
           self.label_index_correct = tf.placeholder(tf.int32, shape = [None, 3])
           self.label_index_current = tf.placeholder(tf.int32, shape = [None, 3])
           self.transition_correct_holder = tf.placeholder(tf.int32, [None, 2])
@@ -171,86 +230,346 @@ class DNN(DNNBase):
           self.loss = self.loss_scores / self.batch_size + self.regularization
           self.loss_with_init = self.loss_scores_with_init / self.batch_size + self.regularization_with_init
         else:
+          # 预测时batch大小不固定，可以一次计算多个补齐后的句子
+          self.input = tf.placeholder(tf.int32,
+                                      shape = [None, None, self.window_size],
+                                      name = 'batch_input')
+          input_shape = tf.shape(self.input)
+          self.look_up = tf.reshape(
+            self.embedding_lookup(self.input),
+            [-1, self.concat_embed_size])
           self.input_embeds = tf.reshape(
-            tf.nn.embedding_lookup(self.embeddings, self.input),
-            [1, -1, self.concat_embed_size])
+            self.embedding_lookup(self.input),
+            [input_shape[0], -1, self.concat_embed_size])
+          self.build_sequence_length(input_shape[0], input_shape[1])
           self.lstm_output, self.lstm_out_state = tf.nn.dynamic_rnn(self.lstm,
                                                                     self.input_embeds,
+                                                                    sequence_length = self.sequence_length,
                                                                     dtype = self.dtype)
-          self.word_scores = tf.matmul(self.w, tf.transpose(
-            self.lstm_output[-1, :, :])) + self.b[:, :, -1]
+          self.batch_scores = tf.tensordot(self.w,
+                                           tf.transpose(self.lstm_output),
+                                           [[1], [0]]) + self.b
+          self.batch_scores = tf.identity(self.batch_scores, name = 'batch_scores')
+          self.word_scores = self.batch_scores[:, :, 0]
+          self.build_decode(tf.transpose(self.batch_scores, [2, 1, 0]))
 
     if self.is_seg == False:
-      gvs = self.optimizer.compute_gradients(self.loss)
-      cliped_grad = [
-        (tf.clip_by_norm(grad, 5) if grad is not None else grad, var) for
-        grad, var in gvs]
-      self.train = self.optimizer.apply_gradients(
-        cliped_grad)  # self.optimizer.minimize(self.loss)
+      self.train = self.clip_minimize(self.loss)  # self.optimizer.minimize(self.loss)
     if self.is_seg == False and self.type == 'lstm':
-      gvs2 = self.optimizer.compute_gradients(self.loss_with_init)
-      cliped_grad2 = [
-        (tf.clip_by_norm(grad2, 5) if grad2 is not None else grad2, var2) for
-        grad2, var2 in gvs2]
-      self.train_with_init = self.optimizer.apply_gradients(cliped_grad2)
+      self.train_with_init = self.clip_minimize(self.loss_with_init)
       # self.train_with_init = self.optimizer.minimize(self.loss_with_init)
+    if self.is_seg == False and self.is_fused:
+      self.build_train_step(self.mode == TrainMode.Sentence)
     self.saver = tf.train.Saver(max_to_keep = 100)
     # self.saver.restore(self.sess, 'tmp/lstm-bbbmodel6.ckpt')
     self.sentence_index = 0
+    self.model_path = None
+
+  def load_model(self, model_path):
+    """
+    恢复模型参数，已恢复的模型不再重复初始化和恢复
+    """
+    if self.model_path == model_path:
+      return
+    if self.is_quantized:
+      raise Exception('quantized model can only load exported inference model')
+    if self.model_path is None:
+      tf.global_variables_initializer().run(session = self.sess)
+    self.saver.restore(self.sess, model_path)
+    self.model_path = model_path
+
+  def embedding_lookup(self, ids):
+    if self.is_quantized:
+      return dequantize_lookup(self.embeddings, self.embeddings_scale, ids)
+    return tf.nn.embedding_lookup(self.embeddings, ids)
+
+  def load_inference(self, export_path):
+    """
+    加载export_inference导出的预测模型
+    """
+    if self.model_path == export_path:
+      return
+    load_inference(self.sess, export_path)
+    self.model_path = export_path
+
+  def export_inference(self, model_path, export_path, is_half = False,
+                       is_frozen = False, is_quantized = False):
+    """
+    由训练的checkpoint导出预测模型，只能由is_seg为True的DNN导出，冻结的计算图输入为
+    补齐后的多个句子batch_input和每个句子的长度sequence_length，输出为decode_labels、
+    constraint_decode_labels和分数batch_scores
+    :param is_quantized: 是否将embeddings和全连接层的权重按行量化为int8，
+    以is_quantized=True构建的DNN加载后embeddings在内存中仍为int8
+    """
+    if not self.is_seg:
+      raise Exception('inference model can only be exported with is_seg')
+    self.load_model(model_path)
+    quantized_variables = []
+    if is_quantized:
+      if self.type == 'mlp':
+        quantized_variables = [self.embeddings, self.hidden_w, self.w]
+      else:
+        quantized_variables = [self.embeddings, self.w]
+    export_inference(self.sess, export_path,
+                     [self.decode_labels.op.name,
+                      self.constraint_decode_labels.op.name,
+                      self.batch_scores.op.name],
+                     is_half, is_frozen, quantized_variables)
+
+  def export_numpy(self, model_path, export_path = 'tmp/mlp-model.npz',
+                   is_quantized = False):
+    """
+    将MLP模型的参数和字典导出为NumPy文件，供不依赖TensorFlow的MLPTagger使用
+    :param is_quantized: 是否将embeddings、hidden_w和w按行量化为int8
+    """
+    if self.type != 'mlp':
+      raise Exception('only mlp model can be exported')
+    self.load_model(model_path)
+    embeddings, hidden_w, hidden_b, w, b, transition, transition_init = self.sess.run(
+      [self.embeddings, self.hidden_w, self.hidden_b, self.w, self.b,
+       self.transition, self.transition_init])
+    words = list(self.dictionary.keys())
+    scales = {}
+    if is_quantized:
+      embeddings, scales['embeddings_scale'] = quantize_rows(embeddings)
+      hidden_w, scales['hidden_w_scale'] = quantize_rows(hidden_w)
+      w, scales['w_scale'] = quantize_rows(w)
+    np.savez(export_path, embeddings = embeddings, hidden_w = hidden_w,
+             hidden_b = hidden_b, w = w, b = b, transition = transition,
+             transition_init = transition_init, task = self.task,
+             skip_window_left = self.skip_window_left,
+             skip_window_right = self.skip_window_right,
+             dict_words = np.array(words),
+             dict_indices = np.array([self.dictionary[word] for word in words],
+                                     dtype = np.int32), **scales)
+
+  def build_dataset(self):
+    """
+    构建训练数据的输入管道，每轮按打乱的索引读取数据，不复制数据本身，并预取下一个batch
+    """
+    count = len(self.character_batches)
+    if self.mode == TrainMode.Sentence:
+      shapes = [[None, self.window_size], [None]]
+
+      def get_item(index):
+        return (np.asarray(self.character_batches[index], np.int32),
+                np.asarray(self.label_batches[index], np.int32))
+    else:
+      shapes = [[self.batch_size, None, self.window_size],
+                [self.batch_size, None], [self.batch_size]]
+
+      def get_item(index):
+        return (np.asarray(self.character_batches[index], np.int32),
+                np.asarray(self.label_batches[index], np.int32),
+                np.asarray(self.lengths[index], np.int32))
+
+    def load(index):
+      items = tf.py_func(get_item, [index], [tf.int32] * len(shapes))
+      for item, shape in zip(items, shapes):
+        item.set_shape(shape)
+      return tuple(items)
+
+    dataset = tf.data.Dataset.range(count).shuffle(count).map(load).prefetch(1)
+    self.iterator = dataset.make_initializable_iterator()
+    self.next_batch = self.iterator.get_next()
+
+  def input_holder(self, index, shape, name = None):
+    # 使用输入管道时默认读取下一个batch，也可以通过feed_dict传入数据
+    if self.is_dataset:
+      return tf.placeholder_with_default(self.next_batch[index], shape, name)
+    else:
+      return tf.placeholder(tf.int32, shape, name)
+
+  def build_sequence_length(self, batch_size, length):
+    """
+    每个句子的实际长度，LSTM和解码都只计算到实际长度，默认为补齐后的长度
+    """
+    if self.is_dataset and self.mode == TrainMode.Batch:
+      self.sequence_length = self.input_holder(2, [None])
+    else:
+      self.sequence_length = tf.placeholder_with_default(
+        tf.fill([batch_size], length), [None], 'sequence_length')
+
+  def build_decode(self, potentials):
+    """
+    在计算图中进行维特比解码，一次sess.run即可由输入得到标签
+    :param potentials: 分数矩阵，batch_size*length*tags
+    """
+    self.potentials = potentials
+    transition_mask, init_mask = [tf.constant(mask, dtype = self.dtype) for mask
+                                  in self.get_transition_mask()]
+    self.decode_labels = tf.identity(
+      self.crf_decode(potentials, self.transition, self.transition_init),
+      name = 'decode_labels')
+    self.constraint_decode_labels = tf.identity(
+      self.crf_decode(potentials, self.transition + transition_mask,
+                      self.transition_init + init_mask),
+      name = 'constraint_decode_labels')
+
+  def crf_decode(self, potentials, transition, transition_init):
+    # 初始转移分数加到第一个位置上
+    potentials = tf.concat([potentials[:, :1, :] + transition_init,
+                            potentials[:, 1:, :]], 1)
+    labels, _ = tf.contrib.crf.crf_decode(potentials, transition,
+                                          self.sequence_length)
+    return labels
+
+  def clip_minimize(self, loss):
+    gvs = self.optimizer.compute_gradients(loss)
+    cliped_grad = [
+      (tf.clip_by_norm(grad, 5) if grad is not None else grad, var) for
+      grad, var in gvs]
+    return self.optimizer.apply_gradients(cliped_grad)
+
+  def build_train_step(self, is_hinge):
+    """
+    构建一次sess.run完成前向计算、解码、参数更新和转移矩阵更新的训练步骤，
+    前向计算只进行一次，解码结果直接用于损失函数和转移矩阵更新
+    :param is_hinge: 解码时是否对错误标签加上hinge_discount，与train_sentence一致
+    """
+    if self.is_dataset and self.mode == TrainMode.Sentence:
+      self.correct_labels = tf.placeholder_with_default(
+        tf.expand_dims(self.next_batch[1], 0), [None, None])
+    else:
+      self.correct_labels = self.input_holder(1, [None, None])
+    mask = tf.expand_dims(tf.sequence_mask(self.sequence_length,
+                                           tf.shape(self.potentials)[1],
+                                           dtype = self.dtype), -1)
+    # 补齐位置的标签超出标签数，one_hot后为全0
+    correct = tf.one_hot(self.correct_labels, self.tags_count,
+                         dtype = self.dtype) * mask
+    if is_hinge:
+      decode_potentials = self.potentials + self.hinge_discount * (1 - correct)
+    else:
+      decode_potentials = self.potentials
+    current = tf.one_hot(self.crf_decode(decode_potentials, self.transition,
+                                         self.transition_init),
+                         self.tags_count, dtype = self.dtype) * mask
+    # 标签相同的位置相互抵消，与只统计错误位置的更新等价
+    label_diff = current - correct
+    transition_diff = tf.reduce_sum(
+      tf.matmul(current[:, :-1, :], current[:, 1:, :], transpose_a = True) -
+      tf.matmul(correct[:, :-1, :], correct[:, 1:, :], transpose_a = True), 0)
+    transition_init_diff = tf.reduce_sum(label_diff[:, 0, :], 0)
+    has_error = tf.reduce_any(tf.not_equal(label_diff, 0))
+    error = tf.cast(has_error, self.dtype)
+    emission_loss = tf.reduce_sum(self.potentials * label_diff)
+
+    if self.type == 'mlp':
+      loss = emission_loss + error * tf.contrib.layers.apply_regularization(
+        tf.contrib.layers.l2_regularizer(self.lam), self.params)
+      update_transition = self.transition.assign(tf.cond(
+        has_error,
+        lambda: (1 - self.learning_rate * self.lam) * self.transition -
+                self.learning_rate * transition_diff,
+        lambda: tf.identity(self.transition)))
+      update_transition_init = self.transition_init.assign(tf.cond(
+        tf.reduce_any(tf.not_equal(transition_init_diff, 0)),
+        lambda: (1 - self.learning_rate * self.lam) * self.transition_init -
+                self.learning_rate * transition_init_diff,
+        lambda: tf.identity(self.transition_init)))
+      self.train_step = tf.group(self.clip_minimize(loss), update_transition,
+                                 update_transition_init)
+    else:
+      loss_scores = emission_loss + tf.reduce_sum(
+        self.transition * transition_diff) + tf.reduce_sum(
+        self.transition_init * transition_init_diff)
+      # 与train_batch一致，只有句首标签错误时才使用包含初始转移的正则项
+      has_init_error = tf.reduce_any(tf.not_equal(label_diff[:, 0, :], 0))
+      regularization = tf.cond(has_init_error,
+                               lambda: self.regularization_with_init,
+                               lambda: self.regularization)
+      loss = loss_scores / self.batch_size + error * regularization
+      self.train_step = self.clip_minimize(loss)
 
   def train_exe(self):
     tf.global_variables_initializer().run(session = self.sess)
     self.sess.graph.finalize()
     epochs = 50
+    for i in range(epochs):
+      self.step = i
+      print('epoch:%d' % i)
+      epoch_time = time.time()
+      if self.is_dataset:
+        sentence_count = self.train_dataset_epoch()
+      elif self.mode == TrainMode.Sentence:
+        sentence_count = self.train_sentence_epoch()
+      elif self.mode == TrainMode.Batch:
+        sentence_count = self.train_batch_epoch()
+      print('sentences per second: %.1f' % (
+        sentence_count / (time.time() - epoch_time)))
+      if (i + 1) % 10 == 0:
+        self.save_model(i + 1)
+
+  def train_sentence_epoch(self):
+    if self.is_fused:
+      train_sentence = self.train_sentence_fused
+    else:
+      train_sentence = self.train_sentence
     last_time = time.time()
-    if self.mode == TrainMode.Sentence:
-      for i in range(epochs):
-        print('epoch:%d' % i)
-        for sentence_index, (sentence, labels, length) in enumerate(
-                zip(self.character_batches, self.label_batches, self.lengths)):
-          # self.train_sentence(sentence[:length], labels[:length])
-          self.train_sentence(sentence, labels)
-          self.sentence_index = sentence_index
-          if sentence_index > 0 and sentence_index % 8000 == 0:
-            print(sentence_index)
-            print(time.time() - last_time)
-            last_time = time.time()
-        if (i + 1) % 10 == 0:
-          if self.type == 'mlp':
-            if self.is_embed:
-              self.saver.save(self.sess,
-                              'tmp/mlp/mlp-ner-embed-model{0}.ckpt'.format(
-                                i + 1))
-            else:
-              self.saver.save(self.sess,
-                              'tmp/mlp/mlp-ner-model{0}.ckpt'.format(i + 1))
-          elif self.type == 'lstm':
-            if self.is_embed:
-              self.saver.save(self.sess,
-                              'tmp/lstm/lstm-ner-embed-model{0}.ckpt'.format(
-                                i + 1))
-            else:
-              self.saver.save(self.sess,
-                              'tmp/lstm/lstm-ner-model{0}.ckpt'.format(i + 1))
-    elif self.mode == TrainMode.Batch:
-      for i in range(epochs):
-        self.step = i
-        print('epoch:%d' % i)
-        for batch_index, (character_batch, label_batch, lengths) in enumerate(
-                zip(self.character_batches, self.label_batches, self.lengths)):
-          self.train_batch(character_batch, label_batch, lengths)
-          if batch_index > 0 and batch_index % 100 == 0:
-            print(batch_index)
-            print(time.time() - last_time)
-            last_time = time.time()
-        if (i + 1) % 10 == 0:
-          if self.is_embed:
-            self.saver.save(self.sess,
-                            'tmp/lstm/lstm-ner-embed-model{0}.ckpt'.format(
-                              i + 1))
-          else:
-            self.saver.save(self.sess,
-                            'tmp/lstm/lstm-ner-model{0}.ckpt'.format(i + 1))
+    for sentence_index, (sentence, labels, length) in enumerate(
+            zip(self.character_batches, self.label_batches, self.lengths)):
+      # self.train_sentence(sentence[:length], labels[:length])
+      train_sentence(sentence, labels)
+      self.sentence_index = sentence_index
+      if sentence_index > 0 and sentence_index % 8000 == 0:
+        print(sentence_index)
+        print(time.time() - last_time)
+        last_time = time.time()
+    return len(self.character_batches)
+
+  def train_batch_epoch(self):
+    if self.is_fused:
+      train_batch = self.train_batch_fused
+    else:
+      train_batch = self.train_batch
+    last_time = time.time()
+    for batch_index, (character_batch, label_batch, lengths) in enumerate(
+            zip(self.character_batches, self.label_batches, self.lengths)):
+      train_batch(character_batch, label_batch, lengths)
+      if batch_index > 0 and batch_index % 100 == 0:
+        print(batch_index)
+        print(time.time() - last_time)
+        last_time = time.time()
+    return len(self.character_batches) * self.batch_size
+
+  def train_dataset_epoch(self):
+    """
+    从输入管道读取数据训练一轮，融合训练步骤不经过feed_dict，直接在计算图中读取数据
+    """
+    self.sess.run(self.iterator.initializer)
+    batch_count = 0
+    while True:
+      try:
+        if self.is_fused:
+          self.sess.run(self.train_step)
+        elif self.mode == TrainMode.Sentence:
+          self.train_sentence(*self.sess.run(self.next_batch))
+        else:
+          self.train_batch(*self.sess.run(self.next_batch))
+      except tf.errors.OutOfRangeError:
+        break
+      batch_count += 1
+    if self.mode == TrainMode.Batch:
+      return batch_count * self.batch_size
+    else:
+      return batch_count
+
+  def save_model(self, epoch):
+    if self.type == 'mlp' and self.mode == TrainMode.Sentence:
+      if self.is_embed:
+        self.saver.save(self.sess,
+                        'tmp/mlp/mlp-ner-embed-model{0}.ckpt'.format(epoch))
+      else:
+        self.saver.save(self.sess,
+                        'tmp/mlp/mlp-ner-model{0}.ckpt'.format(epoch))
+    else:
+      if self.is_embed:
+        self.saver.save(self.sess,
+                        'tmp/lstm/lstm-ner-embed-model{0}.ckpt'.format(epoch))
+      else:
+        self.saver.save(self.sess,
+                        'tmp/lstm/lstm-ner-model{0}.ckpt'.format(epoch))
 
   def train_sentence(self, sentence, labels):
     scores = self.sess.run(self.word_scores, feed_dict = {self.input: sentence})
@@ -284,51 +603,25 @@ class DNN(DNNBase):
       self.sess.run(self.update_transition_init, feed_dict = {
         self.transition_init_holder: transition_init_update})
 
+  def train_sentence_fused(self, sentence, labels):
+    self.sess.run(self.train_step, feed_dict = {self.input: sentence,
+                                                self.correct_labels: [labels]})
+
+  def train_batch_fused(self, sentence_batches, label_batches, lengths):
+    self.sess.run(self.train_step,
+                  feed_dict = {self.input: sentence_batches,
+                               self.correct_labels: label_batches,
+                               self.sequence_length: lengths})
+
   def train_batch(self, sentence_batches, label_batches, lengths):
-    scores = self.sess.run(self.word_scores,
-                           feed_dict = {self.input: sentence_batches})
-    transition = self.transition.eval(session = self.sess)
-    transition_init = self.transition_init.eval(session = self.sess)
-    update_labels_pos = None
-    update_labels_neg = None
-    current_labels = []
-    trans_pos_indices = []
-    trans_neg_indices = []
-    trans_init_pos_indices = []
-    trans_init_neg_indices = []
-    for i in range(self.batch_size):
-      current_label = self.viterbi(scores[:, :lengths[i], i], transition,
-                                   transition_init)
-      # current_label = self.viterbi(scores[:, :lengths[i], i], transition, transition_init, is_constraint=True,
-      #                             labels=label_batches[i, :lengths[i]])
-      # current_label = self.viterbi_new(scores[:, :lengths[i], i], transition, transition_init,
-      #                                 label_batches[i, :lengths[i]])
-      current_labels.append(current_label)
-      diff_tag = np.subtract(label_batches[i, :lengths[i]], current_label)
-      update_index = np.where(diff_tag != 0)[0]
-      update_length = len(update_index)
-      if update_length == 0:
-        continue
-      update_label_pos = np.stack([label_batches[i, update_index], update_index,
-                                   i * np.ones([update_length])], axis = -1)
-      update_label_neg = np.stack([current_label[update_index], update_index,
-                                   i * np.ones([update_length])], axis = -1)
-      if update_labels_pos is not None:
-        np.concatenate((update_labels_pos, update_label_pos))
-        np.concatenate((update_labels_neg, update_label_neg))
-      else:
-        update_labels_pos = update_label_pos
-        update_labels_neg = update_label_neg
-      trans_pos_index, trans_neg_index, trans_init_pos, trans_init_neg, update_init = self.generate_transition_update_index(
-        label_batches[i, :lengths[i]], current_labels[i])
-      trans_pos_indices.extend(trans_pos_index)
-      trans_neg_indices.extend(trans_neg_index)
-      if update_init:
-        trans_init_pos_indices.append(trans_init_pos)
-        trans_init_neg_indices.append(trans_init_neg)
-
-    if update_labels_pos is not None and update_labels_neg is not None:
+    current_label_batches = self.sess.run(self.decode_labels, feed_dict = {
+      self.input: sentence_batches, self.sequence_length: lengths})
+    update_labels_pos, update_labels_neg, trans_pos_indices, trans_neg_indices, trans_init_pos_indices, trans_init_neg_indices = self.generate_batch_update_index(
+      label_batches, current_label_batches, lengths)
+
+    if len(update_labels_pos) != 0:
       feed_dict = {self.input: sentence_batches,
+                   self.sequence_length: lengths,
                    self.label_index_current: update_labels_neg,
                    self.label_index_correct: update_labels_pos,
                    self.transition_current_holder: trans_neg_indices,
@@ -343,9 +636,8 @@ class DNN(DNNBase):
         self.sess.run(self.train_with_init, feed_dict)
 
   def seg(self, sentence, model_path = 'tmp/mlp-model0.ckpt', debug = False,
-          ner = False, trans = False):
-    tf.global_variables_initializer().run(session = self.sess)
-    self.saver.restore(self.sess, model_path)
+          ner = False, trans = False, is_constraint = False, beam_size = None):
+    self.load_model(model_path)
     if not trans:
       s = self.sentence2index(sentence)
     else:
@@ -353,27 +645,131 @@ class DNN(DNNBase):
         s = sentence.tolist()
       else:
         s = sentence
-    seq = self.index2seq(s)
+    seq = [self.index2seq(s)]
 
-    sentence_scores = self.sess.run(self.word_scores,
-                                    feed_dict = {self.input: seq})
-    transition_init = self.transition_init.eval(session = self.sess)
-    transition = self.transition.eval(session = self.sess)
     if debug:
-      print(transition)
+      sentence_scores = self.sess.run(self.word_scores,
+                                      feed_dict = {self.input: seq})
+      print(self.transition.eval(session = self.sess))
       embeds = self.sess.run(self.look_up, feed_dict = {self.input: seq})
       print(sentence_scores)
       if self.type == 'lstm':
         output = self.sess.run(self.lstm_output, feed_dict = {self.input: seq})
         print(output[-1, :, 10])
       print(self.transition_init.eval(session = self.sess))
-    current_labels = self.viterbi(sentence_scores, transition, transition_init)
+    if beam_size is None:
+      if is_constraint:
+        decode_labels = self.constraint_decode_labels
+      else:
+        decode_labels = self.decode_labels
+      current_labels = self.sess.run(decode_labels,
+                                     feed_dict = {self.input: seq})[0]
+    else:
+      sentence_scores, transition, transition_init = self.sess.run(
+        [self.word_scores, self.transition, self.transition_init],
+        feed_dict = {self.input: seq})
+      current_labels = self.viterbi_beam(sentence_scores, transition,
+                                         transition_init, beam_size,
+                                         is_constraint = is_constraint)
     if not ner:
       return self.tags2words(sentence, current_labels), current_labels
+    elif self.task == 'category' and not trans:
+      return self.tags2category_entities(sentence, current_labels), current_labels
     else:
       # return self.tags2entities(sentence, current_labels), current_labels
       return None, current_labels
-      # return self.tags2category_entities(sentence, current_labels), current_labels
+
+  def seg_batch(self, sentences, model_path = 'tmp/mlp-model0.ckpt', ner = False,
+                trans = False, is_constraint = False, batch_size = 256,
+                beam_size = None):
+    """
+    批量预测，每batch_size个句子只运行一次计算图并整体解码
+    :param sentences: 句子列表，trans为True时为字符索引列表
+    :param batch_size: 每次运行计算图的句子数
+    :param beam_size: 不为None时取出分数后用viterbi_beam_batch束搜索解码，用于标签数较多的category任务
+    :return: 按输入顺序排列的结果，每项与seg的返回值相同
+    """
+    self.load_model(model_path)
+    if trans:
+      indices = [s.tolist() if isinstance(s, np.ndarray) else list(s) for s in
+                 sentences]
+    else:
+      indices = [self.sentence2index(s) for s in sentences]
+    lengths = np.array([len(s) for s in indices], dtype = np.int32)
+    labels = [[] for _ in indices]
+    # 按长度排序后分组，减少补齐的长度
+    order = [i for i in np.argsort(lengths, kind = 'stable') if lengths[i] > 0]
+    for start in range(0, len(order), batch_size):
+      batch = order[start:start + batch_size]
+      batch_lengths = lengths[batch]
+      # MLP和LSTM使用与seg相同的计算图解码，补齐的位置不参与解码
+      seq_batch = np.zeros([len(batch), batch_lengths.max(), self.window_size],
+                           dtype = np.int32)
+      for i, index in enumerate(batch):
+        seq_batch[i, :lengths[index]] = self.index2seq(indices[index])
+      feed_dict = {self.input: seq_batch, self.sequence_length: batch_lengths}
+      if beam_size is None:
+        decode_labels = self.constraint_decode_labels if is_constraint else self.decode_labels
+        batch_labels = self.sess.run(decode_labels, feed_dict = feed_dict)
+      else:
+        batch_scores, transition, transition_init = self.sess.run(
+          [self.batch_scores, self.transition, self.transition_init],
+          feed_dict = feed_dict)
+        batch_labels = self.viterbi_beam_batch(batch_scores, transition,
+                                               transition_init, batch_lengths,
+                                               beam_size,
+                                               is_constraint = is_constraint)
+      for i, index in enumerate(batch):
+        labels[index] = np.asarray(batch_labels[i][:lengths[index]])
+
+    results = []
+    for sentence, current_labels in zip(sentences, labels):
+      if not ner:
+        results.append((self.tags2words(sentence, current_labels), current_labels))
+      elif self.task == 'category' and not trans:
+        results.append((self.tags2category_entities(sentence, current_labels), current_labels))
+      else:
+        results.append((None, current_labels))
+    return results
+
+
+class DNNPredictor:
+  """
+  常驻的分词和命名实体识别预测器，模型只加载一次，之后可以进行任意次预测
+  """
+
+  def __init__(self, model_path, type = 'mlp', task = 'ner', is_inference = False,
+               is_quantized = False):
+    # is_quantized为True时model_path为以is_quantized=True导出的预测模型，embeddings以int8常驻内存
+    if is_quantized and not is_inference:
+      raise Exception('quantized model must be an exported inference model')
+    if type == 'mlp':
+      self.dnn = DNN('mlp', mode = TrainMode.Sentence, task = task, is_seg = True,
+                     is_quantized = is_quantized)
+    else:
+      self.dnn = DNN('lstm', task = task, is_seg = True,
+                     is_quantized = is_quantized)
+    self.model_path = model_path
+    # is_inference为True时model_path为export_inference导出的预测模型
+    if is_inference:
+      self.dnn.load_inference(model_path)
+    else:
+      self.dnn.load_model(model_path)
+
+  def seg(self, sentence, trans = False, **kwargs):
+    return self.dnn.seg(sentence, self.model_path, trans = trans, **kwargs)
+
+  def ner(self, sentence, trans = False, **kwargs):
+    return self.dnn.seg(sentence, self.model_path, ner = True, trans = trans,
+                        **kwargs)
+
+  def seg_batch(self, sentences, trans = False, **kwargs):
+    return self.dnn.seg_batch(sentences, self.model_path, trans = trans,
+                              **kwargs)
+
+  def ner_batch(self, sentences, trans = False, **kwargs):
+    return self.dnn.seg_batch(sentences, self.model_path, ner = True,
+                              trans = trans, **kwargs)
 
 
 if __name__ == '__main__':
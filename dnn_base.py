@@ -1,4 +1,5 @@
 # -*- coding: UTF-8 -*-
+import time
 import numpy as np
 from base import Base
 from collections import OrderedDict
@@ -13,7 +14,10 @@ class DNNBase(Base):
     self.skip_window_right = 1
     self.window_size = self.skip_window_left + self.skip_window_right + 1
     self.hinge_discount = 0.2
+    self.task = 'ner'
+    self.beam_size = 8
     self.reverse_categories, self.category_reverse_dict, self.zh_categories = self.init_categories()
+    self.transition_masks = {}
 
   def init_categories(self):
     categories = {'Sign': 'SN', 'Symptom': 'SYM', 'Part': 'PT', 'Property': 'PTY', 'Degree': 'DEG',
@@ -37,71 +41,293 @@ class DNNBase(Base):
     return OrderedDict(zip(categories.values(), categories.keys())), OrderedDict(
       zip(category_labels_dict.values(), category_labels_dict.keys())), zh_categories
 
-  def viterbi(self, emission, A, init_A, return_score=False, is_constraint=False, labels=None, size=4):
+  def build_transition_mask(self, task):
+    """
+    根据标注体系构建转移约束，合法转移为0，非法转移为-inf，直接与转移矩阵相加
+    :param task: 标注体系，'cws'为BMES，'ner'为BIO，'category'为init_categories中的实体类别标签
+    :return: 转移约束矩阵tags*tags，初始转移约束tags
+    """
+    if task == 'cws':
+      # 0:S 1:B 2:M 3:E
+      allowed = [[0, 1], [2, 3], [2, 3], [0, 1]]
+      init_allowed = [0, 1]
+    elif task == 'ner':
+      # 0:O 1:B 2:I
+      allowed = [[0, 1], [0, 1, 2], [0, 1, 2]]
+      init_allowed = [0, 1]
+    elif task == 'category':
+      names = list(self.category_reverse_dict.values())
+      begins = [i for i, name in enumerate(names) if name.endswith('_B')]
+      allowed = []
+      for name in names:
+        # 实体内部标签只能接在同类实体之后，补齐标签P不参与解码
+        if name.endswith('_B') or name.endswith('_O'):
+          inside = [names.index(name[:-2] + '_O')]
+        else:
+          inside = []
+        allowed.append([0] + begins + inside)
+      init_allowed = [0] + begins
+    else:
+      raise Exception('task name error')
+
+    tags_count = len(allowed)
+    transition_mask = np.full([tags_count, tags_count], -np.inf)
+    init_mask = np.full([tags_count], -np.inf)
+    for prev, curr_labels in enumerate(allowed):
+      transition_mask[prev, curr_labels] = 0
+    init_mask[init_allowed] = 0
+    return transition_mask, init_mask
+
+  def get_transition_mask(self, task=None):
+    """
+    获取当前标注体系的转移约束，每种标注体系只构建一次
+    """
+    if task is None:
+      task = self.task
+    if task not in self.transition_masks:
+      self.transition_masks[task] = self.build_transition_mask(task)
+    return self.transition_masks[task]
+
+  def viterbi(self, emission, A, init_A, return_score=False, is_constraint=False, labels=None, size=4,
+              is_first=False):
     """
     维特比算法的实现，所有输入和返回参数均为numpy数组对象
+    每个位置只做一次tags*tags的广播运算，代替逐个标签的三重循环
     :param emission: 发射概率矩阵，对应于本模型中的分数矩阵，4*length
     :param A: 转移概率矩阵，4*4
     :param init_A: 初始转移概率矩阵，4
     :param return_score: 是否返回最优路径的分值，默认为False
+    :param is_constraint: 是否按self.task对应的标注体系限制标签之间的转移
+    :param labels: 正确标签序列，不为None时对错误标签加上hinge_discount
+    :param size: 保留以兼容旧接口，标签数以self.tags_count为准
+    :param is_first: 分值相同时是否取第一个前驱标签，与计算图中的crf_decode一致，默认与原实现一样取最后一个
     :return: 最优路径，若return_score为True，返回最优路径及其对应分值
     """
-
-    constraint = [[0, 1], [2, 3], [2, 3], [0, 1]]
     length = emission.shape[1]
     path = np.ones([self.tags_count, length], dtype=np.int32) * -1
     corr_path = np.zeros([length], dtype=np.int32)
     path_score = np.ones([self.tags_count, length], dtype=np.float64) * (np.finfo('f').min / 2)
     path_score[:, 0] = init_A + emission[:, 0]
 
+    if is_constraint:
+      transition_mask, init_mask = self.get_transition_mask()
+      A = A + transition_mask
+      path_score[:, 0] += init_mask
+
     if labels is not None:
-      for i in range(size):
-        if i != labels[0]:
-          path_score[i, 0] += self.hinge_discount
+      discount = np.where(np.arange(self.tags_count) != np.asarray(labels)[:, None], self.hinge_discount, 0.0)
+      path_score[:, 0] += discount[0]
 
+    # 原实现中分值相同时取最后一个前驱标签，因此在翻转后的前驱轴上取argmax
+    last_prev = self.tags_count - 1
     for pos in range(1, length):
-      for t in range(self.tags_count):
-        for prev in range(self.tags_count):
-          if is_constraint:
-            if t not in constraint[prev]:
-              continue
-          temp = path_score[prev][pos - 1] + A[prev][t] + emission[t][pos]
-          if labels is not None:
-            if t != labels[pos]:
-              temp += self.hinge_discount
-          if temp >= path_score[t][pos]:
-            path[t][pos] = prev
-            path_score[t][pos] = temp
+      scores = path_score[:, pos - 1, None] + A + emission[:, pos]
+      if labels is not None:
+        scores += discount[pos]
+      if is_first:
+        best_prev = np.argmax(scores, axis=0)
+      else:
+        best_prev = last_prev - np.argmax(scores[::-1], axis=0)
+      path[:, pos] = best_prev
+      path_score[:, pos] = scores[best_prev, np.arange(self.tags_count)]
 
     max_index = np.argmax(path_score[:, -1])
+    best_score = path_score[max_index, -1]
     corr_path[length - 1] = max_index
     for i in range(length - 1, 0, -1):
       max_index = path[max_index][i]
       corr_path[i - 1] = max_index
     if return_score:
-      return corr_path, path_score[max_index, -1]
+      return corr_path, best_score
+    else:
+      return corr_path
+
+  def viterbi_batch(self, emission, A, init_A, lengths, return_score=False, is_constraint=False, labels=None):
+    """
+    批量维特比算法，一次解码整个batch，补齐位置被屏蔽，不影响解码结果
+    :param emission: 发射概率矩阵，tags*batch_length*batch_size
+    :param A: 转移概率矩阵，tags*tags
+    :param init_A: 初始转移概率矩阵，tags
+    :param lengths: 每个句子的实际长度，batch_size
+    :param return_score: 是否返回最优路径的分值，默认为False
+    :param is_constraint: 是否按self.task对应的标注体系限制标签之间的转移
+    :param labels: 正确标签矩阵，batch_size*batch_length，不为None时对错误标签加上hinge_discount
+    :return: 最优路径矩阵，batch_size*batch_length，补齐位置为0，若return_score为True，同时返回每个句子最优路径的分值
+    """
+    _, length, batch_size = emission.shape
+    lengths = np.asarray(lengths)
+    tags = np.arange(self.tags_count)
+    path = np.empty([self.tags_count, length, batch_size], dtype=np.int32)
+    path[:, 0, :] = -1
+    corr_path = np.zeros([batch_size, length], dtype=np.int32)
+    path_score = np.empty([self.tags_count, batch_size], dtype=np.float64)
+    path_score[:] = init_A[:, None] + emission[:, 0, :]
+
+    if is_constraint:
+      transition_mask, init_mask = self.get_transition_mask()
+      A = A + transition_mask
+      path_score += init_mask[:, None]
+
+    if labels is not None:
+      # batch_length*tags*batch_size
+      discount = np.where(tags[None, :, None] != np.asarray(labels).T[:, None, :], self.hinge_discount, 0.0)
+      path_score += discount[0]
+
+    last_prev = self.tags_count - 1
+    for pos in range(1, length):
+      # prev*tags*batch_size
+      scores = path_score[:, None, :] + A[:, :, None] + emission[None, :, pos, :]
+      if labels is not None:
+        scores += discount[pos]
+      best_prev = last_prev - np.argmax(scores[::-1], axis=0)
+      best_score = np.take_along_axis(scores, best_prev[None], axis=0)[0]
+      active = pos < lengths
+      # 超出句子长度的位置保持原分值，回溯指针指向自身
+      path[:, pos, :] = np.where(active, best_prev, tags[:, None])
+      path_score = np.where(active, best_score, path_score)
+
+    batch_index = np.arange(batch_size)
+    max_index = np.argmax(path_score, axis=0)
+    best_scores = path_score[max_index, batch_index]
+    corr_path[:, length - 1] = max_index
+    for i in range(length - 1, 0, -1):
+      max_index = path[max_index, i, batch_index]
+      corr_path[:, i - 1] = max_index
+    corr_path[np.arange(length) >= lengths[:, None]] = 0
+    if return_score:
+      return corr_path, best_scores
+    else:
+      return corr_path
+
+  def viterbi_beam(self, emission, A, init_A, beam_size=None, return_score=False, is_constraint=False, labels=None):
+    """
+    束搜索剪枝的维特比算法，作为只有一个句子的viterbi_beam_batch计算
+    :param emission: 发射概率矩阵，tags*length
+    :param A: 转移概率矩阵，tags*tags
+    :param init_A: 初始转移概率矩阵，tags
+    :param beam_size: 保留的标签数，默认为self.beam_size
+    :param return_score: 是否返回最优路径的分值，默认为False
+    :param is_constraint: 是否按self.task对应的标注体系限制标签之间的转移
+    :param labels: 正确标签序列，不为None时对错误标签加上hinge_discount
+    :return: 最优路径，若return_score为True，返回最优路径及其对应分值
+    """
+    result = self.viterbi_beam_batch(emission[:, :, None], A, init_A, [emission.shape[1]], beam_size, return_score,
+                                     is_constraint, None if labels is None else [labels])
+    if return_score:
+      return result[0][0], result[1][0]
+    else:
+      return result[0]
+
+  def viterbi_beam_batch(self, emission, A, init_A, lengths, beam_size=None, return_score=False, is_constraint=False,
+                         labels=None):
+    """
+    束搜索剪枝的批量维特比算法，每个位置只保留每个句子分值最高的beam_size个标签作为下一位置的前驱，
+    复杂度由O(tags^2*length)降为O(beam_size*tags*length)
+    整个batch一起用argpartition选出前驱，不排序，分值相同时取argpartition结果中靠前的前驱，
+    因此只有beam_size不小于标签数时才与viterbi结果完全相同，此时直接使用viterbi_batch
+    :param emission: 发射概率矩阵，tags*batch_length*batch_size
+    :param A: 转移概率矩阵，tags*tags
+    :param init_A: 初始转移概率矩阵，tags
+    :param lengths: 每个句子的实际长度，batch_size
+    :param beam_size: 保留的标签数，默认为self.beam_size
+    :param return_score: 是否返回最优路径的分值，默认为False
+    :param is_constraint: 是否按self.task对应的标注体系限制标签之间的转移
+    :param labels: 正确标签矩阵，batch_size*batch_length，不为None时对错误标签加上hinge_discount
+    :return: 最优路径矩阵，batch_size*batch_length，补齐位置为0，若return_score为True，同时返回每个句子最优路径的分值
+    """
+    if beam_size is None:
+      beam_size = self.beam_size
+    if beam_size >= self.tags_count:
+      return self.viterbi_batch(emission, A, init_A, lengths, return_score, is_constraint, labels)
+    _, length, batch_size = emission.shape
+    lengths = np.asarray(lengths)
+    tags = np.arange(self.tags_count)
+    path = np.empty([self.tags_count, length, batch_size], dtype=np.int32)
+    path[:, 0, :] = -1
+    corr_path = np.zeros([batch_size, length], dtype=np.int32)
+    path_score = np.empty([self.tags_count, batch_size], dtype=np.float64)
+    path_score[:] = init_A[:, None] + emission[:, 0, :]
+
+    if is_constraint:
+      transition_mask, init_mask = self.get_transition_mask()
+      A = A + transition_mask
+      path_score += init_mask[:, None]
+
+    if labels is not None:
+      # batch_length*tags*batch_size
+      discount = np.where(tags[None, :, None] != np.asarray(labels).T[:, None, :], self.hinge_discount, 0.0)
+      path_score += discount[0]
+
+    # 按当前标签在前，便于以前驱索引直接取出tags*beam_size*batch_size的转移分数
+    transition = np.ascontiguousarray(A.T)
+    for pos in range(1, length):
+      # beam_size*batch_size
+      beam = np.argpartition(path_score, self.tags_count - beam_size, axis=0)[self.tags_count - beam_size:]
+      # tags*beam_size*batch_size
+      scores = transition[:, beam] + np.take_along_axis(path_score, beam, axis=0) + emission[:, pos, None, :]
+      if labels is not None:
+        scores += discount[pos][:, None, :]
+      best = np.argmax(scores, axis=1)
+      best_score = np.take_along_axis(scores, best[:, None, :], axis=1)[:, 0, :]
+      active = pos < lengths
+      # 超出句子长度的位置保持原分值，回溯指针指向自身
+      path[:, pos, :] = np.where(active, np.take_along_axis(beam, best, axis=0), tags[:, None])
+      path_score = np.where(active, best_score, path_score)
+
+    batch_index = np.arange(batch_size)
+    max_index = np.argmax(path_score, axis=0)
+    best_scores = path_score[max_index, batch_index]
+    corr_path[:, length - 1] = max_index
+    for i in range(length - 1, 0, -1):
+      max_index = path[max_index, i, batch_index]
+      corr_path[:, i - 1] = max_index
+    corr_path[np.arange(length) >= lengths[:, None]] = 0
+    if return_score:
+      return corr_path, best_scores
     else:
       return corr_path
 
+  def estimate_beam(self, emissions, A, init_A, beam_size=None, is_constraint=False):
+    """
+    统计束搜索与精确维特比解码结果不一致的比例，以及两者批量解码的耗时
+    :param emissions: 发射概率矩阵列表，每项为tags*length
+    :return: 路径不一致的句子比例，标签不一致的位置比例，viterbi_batch耗时，viterbi_beam_batch耗时（秒）
+    """
+    lengths = np.array([emission.shape[1] for emission in emissions])
+    batch_emission = np.zeros([self.tags_count, lengths.max(), len(emissions)])
+    for i, emission in enumerate(emissions):
+      batch_emission[:, :lengths[i], i] = emission
+    start = time.time()
+    exact_paths = self.viterbi_batch(batch_emission, A, init_A, lengths, is_constraint=is_constraint)
+    exact_time = time.time() - start
+    start = time.time()
+    beam_paths = self.viterbi_beam_batch(batch_emission, A, init_A, lengths, beam_size, is_constraint=is_constraint)
+    beam_time = time.time() - start
+    # 补齐位置均为0，不影响统计
+    diff = exact_paths != beam_paths
+    return (np.count_nonzero(diff.any(axis=1)) / len(emissions), np.count_nonzero(diff) / lengths.sum(),
+            exact_time, beam_time)
+
   def viterbi_new(self, emission, transition, transition_init, labels=None):
-    constraint = [[0, 1], [2, 3], [2, 3], [0, 1]]
+    transition_mask, _ = self.get_transition_mask()
     length = emission.shape[1]
     path = np.ones([self.tags_count, length + 1], dtype=np.int32) * -1
     corr_path = np.zeros([length], dtype=np.int32)
-    path_score = np.ones([self.tags_count, length + 1], dtype=np.float64) * (np.finfo('f').min / 2)
+    floor_score = np.finfo('f').min / 2
+    path_score = np.ones([self.tags_count, length + 1], dtype=np.float64) * floor_score
     # path_score[:, 0] = transition_init + emission[:, 0]
     path_score[0, 0] = 0
 
     for pos in range(1, length + 1):
-      for path_index in range(self.tags_count):
-        for curr_label in constraint[path_index]:
-          tmp = path_score[path_index, pos - 1] + emission[curr_label, pos - 1] + transition[path_index, curr_label]
-          if labels is not None:
-            if curr_label != labels[pos - 1]:
-              tmp += self.hinge_discount
-          if tmp > path_score[curr_label, pos]:
-            path_score[curr_label, pos] = tmp
-            path[curr_label, pos] = path_index
+      scores = path_score[:, pos - 1, None] + emission[:, pos - 1] + transition
+      if labels is not None:
+        scores += np.where(np.arange(self.tags_count) != labels[pos - 1], self.hinge_discount, 0.0)
+      scores += transition_mask
+      best_prev = np.argmax(scores, axis=0)
+      best_score = scores[best_prev, np.arange(self.tags_count)]
+      update = best_score > floor_score
+      path[:, pos] = np.where(update, best_prev, -1)
+      path_score[:, pos] = np.where(update, best_score, floor_score)
 
     # print(path)
     # print(path_score)
@@ -165,6 +391,40 @@ class DNNBase(Base):
 
     return trans_pos, trans_neg, trans_init_pos, trans_init_neg, update_init
 
+  def generate_batch_update_index(self, correct_labels, current_labels, lengths):
+    """
+    一次生成整个batch的更新索引，补齐位置不参与更新
+    :param correct_labels: 正确标签矩阵，batch_size*batch_length
+    :param current_labels: 解码得到的标签矩阵，batch_size*batch_length
+    :param lengths: 每个句子的实际长度，batch_size
+    :return: 发射分数的正负更新索引(标签,位置,句子)，转移矩阵的正负更新索引，初始转移的正负更新索引
+    """
+    if correct_labels.shape != current_labels.shape:
+      print('序列长度不同')
+      return None
+
+    lengths = np.asarray(lengths)
+    valid = np.arange(correct_labels.shape[1]) < lengths[:, None]
+    diff = (correct_labels != current_labels) & valid
+
+    batch_index, position = np.nonzero(diff)
+    labels_pos = np.stack([correct_labels[batch_index, position], position, batch_index], axis=-1).astype(np.int32)
+    labels_neg = np.stack([current_labels[batch_index, position], position, batch_index], axis=-1).astype(np.int32)
+
+    # 当前位置或前一位置标签不同时更新转移矩阵
+    trans_diff = (diff[:, 1:] | diff[:, :-1]) & valid[:, 1:]
+    batch_index, position = np.nonzero(trans_diff)
+    trans_pos = np.stack([correct_labels[batch_index, position], correct_labels[batch_index, position + 1]],
+                         axis=-1).astype(np.int32)
+    trans_neg = np.stack([current_labels[batch_index, position], current_labels[batch_index, position + 1]],
+                         axis=-1).astype(np.int32)
+
+    init_index = np.nonzero(diff[:, 0])[0]
+    trans_init_pos = correct_labels[init_index, :1].astype(np.int32)
+    trans_init_neg = current_labels[init_index, :1].astype(np.int32)
+
+    return labels_pos, labels_neg, trans_pos, trans_neg, trans_init_pos, trans_init_neg
+
   def sentence2index(self, sentence):
     index = []
     for word in sentence:
@@ -1,9 +1,10 @@
 # -*- coding: UTF-8 -*-
 import numpy as np
-from dnn import DNN
+from dnn import DNN, DNNPredictor
 from prepare_data import PrepareData
 from config import CorpusType, TrainMode
 from re_cnn import RECNN
+from mlp_tagger import MLPTagger
 
 
 def evaluate_mlp():
@@ -55,8 +56,8 @@ def evaluate_model(cws, model):
   re_count = 0
   total_count = 0
 
-  for _, (sentence, label) in enumerate(zip(sentences, labels)):
-    _, tag = cws.seg(sentence, model)
+  results = cws.seg_batch(sentences, model)
+  for _, ((_, tag), label) in enumerate(zip(results, labels)):
     cor_count, prec_count, recall_count = estimate_cws(tag, np.array(label))
     corr_count += cor_count
     re_count += recall_count
@@ -69,6 +70,78 @@ def evaluate_model(cws, model):
   print(2 * prec * recall / (prec + recall))
 
 
+def estimate_tagger(tagger, task='ner'):
+  '''
+  在测试集上计算MLPTagger或DNNPredictor的准确率、召回率和F1值
+  '''
+  if task == 'ner':
+    sentences = np.load('corpus/emr_ner_test_characters.npy', allow_pickle=True)
+    labels = np.load('corpus/emr_ner_test_labels.npy', allow_pickle=True)
+    estimate = estimate_ner
+  else:
+    pre = PrepareData(4000, 'pku', dict_path='corpus/pku_dict.utf8', type=CorpusType.Test)
+    sentences = pre.raw_lines
+    labels = pre.labels_index
+    estimate = estimate_cws
+  corr_count = 0
+  prec_count = 0
+  recall_count = 0
+  for sentence, label in zip(sentences, labels):
+    if len(sentence) == 0:
+      continue
+    _, tag = tagger.seg(sentence, ner=task == 'ner', trans=task == 'ner')
+    corr, prec, recall = estimate(tag, np.array(label))
+    corr_count += corr
+    prec_count += prec
+    recall_count += recall
+  prec = corr_count / prec_count
+  recall = corr_count / recall_count
+  return prec, recall, 2 * prec * recall / (prec + recall)
+
+
+def evaluate_quantized(float_path, quantized_path, task='ner'):
+  '''
+  比较按行int8量化的模型与浮点模型在测试集上的结果，两个模型均由DNN.export_numpy导出
+  '''
+  for name, path in (('float', float_path), ('int8', quantized_path)):
+    tagger = MLPTagger(path)
+    prec, recall, f1 = estimate_tagger(tagger, task)
+    print('%s precision: %.4f recall: %.4f f1: %.4f' % (name, prec, recall, f1))
+
+
+def evaluate_quantized_inference(float_path, quantized_path, type='lstm', task='ner'):
+  '''
+  比较TensorFlow计算图中int8量化的模型与浮点模型在测试集上的结果，
+  两个模型均由DNN.export_inference导出，量化模型以is_quantized=True导出，embeddings以int8加载
+  '''
+  for name, path, is_quantized in (('float', float_path, False), ('int8', quantized_path, True)):
+    tagger = DNNPredictor(path, type, task, is_inference=True, is_quantized=is_quantized)
+    prec, recall, f1 = estimate_tagger(tagger, task)
+    print('%s precision: %.4f recall: %.4f f1: %.4f' % (name, prec, recall, f1))
+
+
+def evaluate_beam(model_path, type='lstm', task='category', corpus='emr_ner', beam_sizes=(4, 8, 16)):
+  '''
+  在测试集上比较束搜索与精确维特比解码，输出结果不一致的比例和两者的解码耗时
+  '''
+  mode = TrainMode.Sentence if type == 'mlp' else TrainMode.Batch
+  dnn = DNN(type, mode=mode, task=task, is_seg=True, corpus=corpus)
+  dnn.load_model(model_path)
+  sentences = np.load('corpus/' + corpus + '_test_characters.npy', allow_pickle=True)
+  transition, transition_init = dnn.sess.run([dnn.transition, dnn.transition_init])
+  emissions = []
+  for sentence in sentences:
+    if len(sentence) == 0:
+      continue
+    scores = dnn.sess.run(dnn.batch_scores, feed_dict={dnn.input: [dnn.index2seq(list(sentence))]})
+    emissions.append(scores[:, :, 0])
+  for beam_size in beam_sizes:
+    sentence_diff, label_diff, exact_time, beam_time = dnn.estimate_beam(emissions, transition, transition_init,
+                                                                         beam_size, is_constraint=True)
+    print('beam %d sentence diff: %.4f label diff: %.4f exact: %.3fs beam: %.3fs' % (
+      beam_size, sentence_diff, label_diff, exact_time, beam_time))
+
+
 def estimate_cws(current_labels, correct_labels):
   cor_dict = {}
   curt_dict = {}
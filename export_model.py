@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+import os
+import numpy as np
+import tensorflow as tf
+from utils import quantize_rows, dequantize_rows
+
+
+def export_inference(sess, export_path, output_names, is_half=False, is_frozen=False, quantized_variables=()):
+  """
+  导出只用于预测的模型，只保存前向计算的参数，不包含优化器的累积量等训练用变量
+  :param sess: 已恢复训练模型参数的会话
+  :param export_path: 导出的模型路径，冻结的计算图保存为export_path + '.pb'
+  :param output_names: 冻结计算图时保留的输出节点名
+  :param is_half: 参数是否以float16保存，加载时转换回计算图中的类型
+  :param is_frozen: 是否同时导出参数转为常量的计算图，冻结的计算图参数保持原类型
+  :param quantized_variables: 按行量化为int8的参数，只用于嵌入矩阵和全连接层的权重，每行的缩放系数保存为变量名加'_scale'
+  """
+  variables = tf.trainable_variables()
+  values = sess.run(variables)
+  quantized_names = set(v.op.name for v in quantized_variables)
+  graph = tf.Graph()
+  with graph.as_default():
+    export_variables = []
+    for variable, value in zip(variables, values):
+      if variable.op.name in quantized_names:
+        value, scale = quantize_rows(value)
+        export_variables.append(tf.Variable(scale, name=variable.op.name + '_scale'))
+      elif is_half:
+        value = value.astype(np.float16)
+      export_variables.append(tf.Variable(value, name=variable.op.name))
+    saver = tf.train.Saver(export_variables)
+    with tf.Session(graph=graph) as export_sess:
+      export_sess.run(tf.variables_initializer(export_variables))
+      saver.save(export_sess, export_path, write_meta_graph=False)
+
+  if is_frozen:
+    frozen_graph = tf.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), output_names)
+    tf.train.write_graph(frozen_graph, os.path.dirname(export_path) or '.',
+                         os.path.basename(export_path) + '.pb', as_text=False)
+
+
+def load_inference(sess, export_path):
+  """
+  加载export_inference导出的参数，计算图中不在导出文件内的变量进行初始化
+  计算图中为int8的变量直接加载量化后的参数，由dequantize_lookup在查表后还原，其余量化的参数加载时还原为浮点数
+  """
+  reader = tf.train.NewCheckpointReader(export_path)
+  variables = tf.global_variables()
+  exported = [v for v in variables if reader.has_tensor(v.op.name)]
+  others = [v for v in variables if not reader.has_tensor(v.op.name)]
+  if len(others):
+    sess.run(tf.variables_initializer(others))
+  for variable in exported:
+    value = reader.get_tensor(variable.op.name)
+    is_scaled = reader.has_tensor(variable.op.name + '_scale')
+    if variable.dtype.base_dtype == tf.int8:
+      if not is_scaled:
+        raise Exception('variable %s is not quantized in %s' % (variable.op.name, export_path))
+    elif is_scaled:
+      value = dequantize_rows(value, reader.get_tensor(variable.op.name + '_scale'))
+    variable.load(value.astype(variable.dtype.as_numpy_dtype), sess)
+
+
+def quantized_variable(shape, dtype, name=None):
+  """
+  预测时保存按行量化参数的int8变量和每行的缩放系数，缩放系数的变量名为int8变量名加'_scale'，与export_inference一致
+  :return: int8变量和缩放系数变量
+  """
+  quantized = tf.Variable(tf.zeros(shape, tf.int8), trainable=False, name=name)
+  scale = tf.Variable(tf.ones([shape[0], 1], dtype), trainable=False, name=quantized.op.name + '_scale')
+  return quantized, scale
+
+
+def dequantize_lookup(quantized, scale, ids, name=None):
+  """
+  由int8矩阵查表后再乘以对应行的缩放系数，只有查到的行转换为浮点数
+  """
+  embeds = tf.cast(tf.nn.embedding_lookup(quantized, ids), scale.dtype)
+  return tf.multiply(embeds, tf.nn.embedding_lookup(scale, ids), name=name)
+
@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+import numpy as np
+from dnn_base import DNNBase
+
+
+class MLPTagger(DNNBase):
+  """
+  不依赖TensorFlow的MLP分词和命名实体识别预测器，参数由DNN.export_numpy导出
+  """
+
+  def __init__(self, export_path = 'tmp/mlp-model.npz', is_table = False):
+    DNNBase.__init__(self)
+    weights = np.load(export_path)
+    self.embeddings = weights['embeddings']
+    self.hidden_w = weights['hidden_w']
+    self.hidden_b = weights['hidden_b']
+    self.w = weights['w']
+    self.b = weights['b']
+    # 按行量化的模型保存int8参数和每行的缩放系数，计算时再转换
+    self.is_quantized = 'embeddings_scale' in weights.files
+    if self.is_quantized:
+      self.embeddings_scale = weights['embeddings_scale']
+      self.hidden_w_scale = weights['hidden_w_scale']
+      self.w_scale = weights['w_scale']
+    self.transition = weights['transition']
+    self.transition_init = weights['transition_init']
+    self.task = str(weights['task'])
+    self.skip_window_left = int(weights['skip_window_left'])
+    self.skip_window_right = int(weights['skip_window_right'])
+    self.window_size = self.skip_window_left + self.skip_window_right + 1
+    self.tags_count = self.w.shape[0]
+    self.dictionary = dict(zip(weights['dict_words'].tolist(),
+                               weights['dict_indices'].tolist()))
+    # 投影表为浮点数，大小为window_size*vocab_size*hidden_units，比int8的embeddings大得多，量化模型不使用
+    if is_table and self.is_quantized:
+      raise Exception('projection table can not be used with quantized model')
+    self.is_table = is_table
+    if self.is_table:
+      self.projection_tables = self.build_projection_tables()
+
+  def build_projection_tables(self):
+    """
+    隐藏层的输入按窗口位置拆分，预先计算每个字在每个窗口位置上的投影
+    :return: 投影表，window_size*vocab_size*hidden_units
+    """
+    embed_size = self.embeddings.shape[1]
+    return np.stack([np.matmul(self.embeddings,
+                               self.hidden_w[:, k * embed_size:(k + 1) * embed_size].T)
+                     for k in range(self.window_size)])
+
+  def word_scores(self, seq):
+    """
+    计算每个字对应各标签的分数，与DNN中的MLP计算图相同
+    :param seq: 窗口索引，length*window_size
+    :return: 分数矩阵，tags*length
+    """
+    if self.is_table:
+      hidden_input = self.hidden_b.T
+      for k in range(self.window_size):
+        hidden_input = hidden_input + self.projection_tables[k][seq[:, k]]
+      hidden = (1.0 / (1.0 + np.exp(-hidden_input))).T
+    elif self.is_quantized:
+      # 每行的缩放系数可以提到矩阵乘法之外，不需要还原整个矩阵
+      input_embeds = (self.embeddings[seq] * self.embeddings_scale[seq]).reshape([len(seq), -1]).T
+      hidden_input = np.matmul(self.hidden_w, input_embeds) * self.hidden_w_scale + self.hidden_b
+      hidden = 1.0 / (1.0 + np.exp(-hidden_input))
+    else:
+      input_embeds = self.embeddings[seq].reshape([len(seq), -1]).T
+      hidden = 1.0 / (1.0 + np.exp(-(np.matmul(self.hidden_w, input_embeds) + self.hidden_b)))
+    if self.is_quantized:
+      return np.matmul(self.w, hidden) * self.w_scale + self.b
+    return np.matmul(self.w, hidden) + self.b
+
+  def seg(self, sentence, ner = False, trans = False, is_constraint = False,
+          beam_size = None):
+    if not trans:
+      s = self.sentence2index(sentence)
+    else:
+      if isinstance(sentence, np.ndarray):
+        s = sentence.tolist()
+      else:
+        s = sentence
+    sentence_scores = self.word_scores(np.array(self.index2seq(s), dtype = np.int32))
+    if beam_size is None:
+      # 分值相同时与DNN.seg中的crf_decode一样取第一个前驱标签
+      current_labels = self.viterbi(sentence_scores, self.transition,
+                                    self.transition_init,
+                                    is_constraint = is_constraint,
+                                    is_first = True)
+    else:
+      current_labels = self.viterbi_beam(sentence_scores, self.transition,
+                                         self.transition_init, beam_size,
+                                         is_constraint = is_constraint)
+    if not ner:
+      return self.tags2words(sentence, current_labels), current_labels
+    else:
+      return None, current_labels
+
+  def ner(self, sentence, trans = False, **kwargs):
+    return self.seg(sentence, ner = True, trans = trans, **kwargs)
@@ -1,23 +1,30 @@
 # -*- coding: UTF-8 -*-
 import numpy as np
-from dnn import DNN
-from config import TrainMode
+from dnn import DNNPredictor
 from re_cnn import RECNN
 from evaluate import estimate_ner
 
 
+predictors = {}
+
+
+def get_predictor(model_name):
+  # 每个模型只构建和恢复一次
+  if model_name not in predictors:
+    if model_name.startswith('tmp/mlp'):
+      predictors[model_name] = DNNPredictor(model_name, 'mlp')
+    else:
+      predictors[model_name] = DNNPredictor(model_name, 'lstm')
+  return predictors[model_name]
+
+
 def get_cws(content, model_name):
-  dnn = DNN('mlp', mode=TrainMode.Sentence, task='ner')
-  ner = dnn.seg(content, model_path=model_name, ner=True, trans=True)[1]
+  ner = get_predictor(model_name).ner(content, trans=True)[1]
   return ner
 
 
 def get_ner(content, model_name):
-  if model_name.startswith('tmp/mlp'):
-    dnn = DNN('mlp', mode=TrainMode.Sentence, task='ner', is_seg=True)
-  else:
-    dnn = DNN('lstm', task='ner', is_seg=True)
-  ner = dnn.seg(content, model_path=model_name, ner=True, trans=True)
+  ner = get_predictor(model_name).ner(content, trans=True)
   return ner[1]
 
 
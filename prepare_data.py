@@ -3,17 +3,18 @@ import numpy as np
 import re
 import os
 import collections
-from utils import plot_lengths
+from utils import plot_lengths, bucket_batches
 from config import CorpusType, TrainMode
 
 
 class PrepareData:
   def __init__(self, vocab_size, corpus, batch_length=224, batch_size=50, dict_path=None, mode=TrainMode.Batch,
-               type=CorpusType.Train):
+               type=CorpusType.Train, is_bucket=False):
     self.vocab_size = vocab_size
     self.dict_path = dict_path
     self.batch_length = batch_length
     self.batch_size = batch_size
+    self.is_bucket = is_bucket  # 按长度分桶，每个batch只补齐到其中最长句子的长度
     self.SPLIT_CHAR = '  '  # 分隔符：双空格
     # 字符数量，
     # 其中'BATCH_PAD'表示构建batch时不足时补的字符，'UNK'表示词汇表外的字符，
@@ -174,7 +175,12 @@ class PrepareData:
             label_batches.append(sentence_labels[:self.batch_length])
             lengths.append(self.batch_length)
 
-    if trunc:
+    if trunc and self.is_bucket:
+      sentence_batches, label_batches, lengths = bucket_batches(sentences, labels, self.batch_size,
+                                                                self.dictionary['BATCH_PAD'], unknown,
+                                                                self.batch_length)
+      return sentence_batches, label_batches, lengths, sentences, labels, sentence_lengths
+    elif trunc:
       extra_count = len(sentence_batches) % self.batch_size
       sentence_batches = np.array(sentence_batches[:-extra_count], dtype=np.int32).reshape(
         [-1, self.batch_size, self.batch_length])
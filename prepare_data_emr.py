@@ -4,12 +4,16 @@ import numpy as np
 from collections import OrderedDict
 import pickle
 from itertools import chain
-from utils import plot_lengths
+from base import Base
+from utils import plot_lengths, bucket_batches, build_relation_matrices
+from relation_store import save_relation_store
 from evaluate import estimate_ner
 
 
-class PrepareDataNer():
-  def __init__(self, entity_batch_length=224, relation_batch_length=85, entity_batch_size=10, relation_batch_size=50):
+class PrepareDataNer(Base):
+  def __init__(self, entity_batch_length=224, relation_batch_length=85, entity_batch_size=10, relation_batch_size=50,
+               is_bucket=False, is_dynamic=False):
+    Base.__init__(self)
     self.entity_tags = {'O': 0, 'B': 1, 'I': 2, 'P': 3}
     self.reversed_tags = dict(zip(self.entity_tags.values(),self.entity_tags.keys()))
     self.entity_categories = {'Sign': 'SN', 'Symptom': 'SYM', 'Part': 'PT', 'Property': 'PTY', 'Degree': 'DEG',
@@ -56,6 +60,8 @@ class PrepareDataNer():
     self.relation_batch_length = relation_batch_length
     self.entity_batch_size = entity_batch_size
     self.relation_batch_size = relation_batch_size
+    self.is_bucket = is_bucket  # 按长度分桶，每个batch只补齐到其中最长句子的长度
+    self.is_dynamic = is_dynamic  # 关系抽取保存完整的句子，读取时每个batch只补齐到其中最长句子的长度
     for _, _, filenames in os.walk(self.base_folder):
       for filename in filenames:
         filename, _ = os.path.splitext(filename)
@@ -101,25 +107,22 @@ class PrepareDataNer():
     with open('corpus/emr_training_relations.rel', 'wb') as f:
       pickle.dump(self.relations, f)
 
-    extra_count = len(self.characters) % self.entity_batch_size
-    lengths = np.array(list(map(lambda item: len(item), self.characters[:-extra_count])), np.int32).reshape(
-      [-1, self.entity_batch_size])
+    if self.is_bucket:
+      self.character_batches, self.label_batches, lengths = self.build_bucket_entity_batch()
+    else:
+      extra_count = len(self.characters) % self.entity_batch_size
+      lengths = np.array(list(map(lambda item: len(item), self.characters[:-extra_count])), np.int32).reshape(
+        [-1, self.entity_batch_size])
+      self.character_batches, self.label_batches = self.build_entity_batch()
     np.save('corpus/emr_ner_training_lengths_batches', lengths)
-    self.character_batches, self.label_batches = self.build_entity_batch()
     np.save('corpus/emr_ner_training_character_batches', self.character_batches)
     np.save('corpus/emr_ner_training_label_batches', self.label_batches)
-    self.train_relation_batches = self.build_relation_batch(self.relations, self.relation_batch_size)
-    self.all_relation_batches = self.build_relation_batch(self.all_relations, self.relation_batch_size)
-    self.test_all_relation_batches = self.build_relation_batch(self.test_all_relations, 1)
-    self.test_relation_batches = self.build_relation_batch(self.test_relations, 1)
-    with open('corpus/emr_relation_batches.rel', 'wb') as f:
-      pickle.dump(self.train_relation_batches, f)
-    with open('corpus/emr_all_relation_batches.rel', 'wb') as f:
-      pickle.dump(self.all_relation_batches, f)
-    with open('corpus/emr_test_relations.rel', 'wb') as f:
-      pickle.dump(self.test_relation_batches, f)
-    with open('corpus/emr_test_all_relations.rel', 'wb') as f:
-      pickle.dump(self.test_all_relation_batches, f)
+    # 按列保存所有实体对，batch大小在读取时指定
+    suffix = '_dynamic' if self.is_dynamic else ''
+    self.save_relations('corpus/emr_relation_batches' + suffix, self.relations)
+    self.save_relations('corpus/emr_all_relation_batches' + suffix, self.all_relations)
+    self.save_relations('corpus/emr_test_relations' + suffix, self.test_relations)
+    self.save_relations('corpus/emr_test_all_relations' + suffix, self.test_all_relations)
 
   def export_coll(self,characters,labels,src_file):
     text = ''
@@ -218,17 +221,6 @@ class PrepareDataNer():
 
     return words_dictionary
 
-  @staticmethod
-  def read_dictionary(dict_path):
-    dict_file = open(dict_path, 'r', encoding='utf-8')
-    dict_content = dict_file.read().splitlines()
-    dictionary = {}
-    dict_arr = map(lambda item: item.split(' '), dict_content)
-    for _, dict_item in enumerate(dict_arr):
-      dictionary[dict_item[0]] = int(dict_item[1])
-    dict_file.close()
-    return dictionary
-
   def build_dataset(self, filenames, ann, is_entity_category=False, is_relation_category=False,
                     is_negative_relation=True):
     rn = ['\r', '\n']
@@ -485,53 +477,35 @@ class PrepareDataNer():
     labels = np.array(labels[:-extra_count], np.int32).reshape([-1, self.entity_batch_size, self.entity_batch_length])
     return characters, labels
 
-  def build_relation_batch(self, relations, batch_size):
-    relation_batches = []
-    sentence_batch = []
-    primary_batch = []
-    secondary_batch = []
-    label_batch = []
-    index = 0
-    for relation in relations:
-      sentence = relation['sentence'].tolist()
-      if len(sentence) > self.relation_batch_length:
-        sentence = sentence[:self.relation_batch_length]
-      else:
-        sentence.extend([self.dictionary['BATCH_PAD']] * (self.relation_batch_length - len(sentence)))
-      primary = relation['primary'].tolist()
-      if len(primary) > self.relation_batch_length:
-        primary = primary[:self.relation_batch_length]
-      else:
-        primary.extend(range(primary[-1] + 1, primary[-1] + 1 + self.relation_batch_length - len(primary)))
-      secondary = relation['secondary'].tolist()
-      if len(secondary) > self.relation_batch_length:
-        secondary = secondary[:self.relation_batch_length]
-      else:
-        secondary.extend(range(secondary[-1] + 1, secondary[-1] + 1 + self.relation_batch_length - len(secondary)))
-      sentence_batch.append(sentence)
-      primary_batch.append(primary)
-      secondary_batch.append(secondary)
-      label_batch.append(relation['label'])
-      index += 1
-      if batch_size != 1:
-        if index > 0 and index % self.relation_batch_size == 0:
-          batch = {'sentence': np.array(sentence_batch, np.int32), 'primary': np.array(primary_batch, np.int32),
-                   'secondary': np.array(secondary_batch, np.int32), 'label': np.array(label_batch, np.float32)}
-          relation_batches.append(batch)
-          sentence_batch.clear()
-          primary_batch.clear()
-          secondary_batch.clear()
-          label_batch.clear()
-          index = 0
-      else:
-        batch = {'sentence': np.array(sentence_batch, np.int32), 'primary': np.array(primary_batch, np.int32),
-                 'secondary': np.array(secondary_batch, np.int32), 'label': np.array(label_batch, np.float32)}
-        relation_batches.append(batch)
-        sentence_batch.clear()
-        primary_batch.clear()
-        secondary_batch.clear()
-        label_batch.clear()
-    return relation_batches
+  def build_bucket_entity_batch(self, category=False):
+    if category:
+      label_pad = self.entity_category_labels['P']
+    else:
+      label_pad = self.entity_tags['P']
+    return bucket_batches(self.characters, self.entity_labels, self.entity_batch_size, self.dictionary['BATCH_PAD'],
+                          label_pad, self.entity_batch_length)
+
+  def build_relation_columns(self, relations):
+    '''
+    构建所有实体对的字索引和两个实体在句子中的位置，is_dynamic为True时字索引为完整句子的列表，
+    否则为截断或补齐到relation_batch_length的矩阵
+    :return: 字索引、两个实体的位置和标签
+    '''
+    base = self.relation_batch_length - 1
+    # 第一个字的位置索引为base - 实体位置
+    primary_index = np.array([base - relation['primary'][0] for relation in relations], np.int32)
+    secondary_index = np.array([base - relation['secondary'][0] for relation in relations], np.int32)
+    labels = np.array([relation['label'] for relation in relations], np.float32)
+    sentences = [relation['sentence'] for relation in relations]
+    if not self.is_dynamic:
+      sentences, _, _ = build_relation_matrices(sentences, primary_index, secondary_index, self.relation_batch_length,
+                                                self.dictionary['BATCH_PAD'], base)
+    return sentences, primary_index, secondary_index, labels
+
+  def save_relations(self, base_path, relations):
+    # 只保存两个实体的位置，相对位置由RECNN在计算图中计算
+    sentences, primary_index, secondary_index, labels = self.build_relation_columns(relations)
+    save_relation_store(base_path, sentences, labels, primary_index=primary_index, secondary_index=secondary_index)
 
 
 def prepare_for_crfpp(folder, output_name):
@@ -1,8 +1,9 @@
 # -*- coding: UTF-8 -*-
 import re
 import numpy as np
-import pickle
 from functools import reduce
+from relation_store import save_relation_store
+from utils import build_relation_matrices
 
 class PrepareDataSemeval:
   def __init__(self, batch_length=95, batch_size=50):
@@ -12,9 +13,10 @@ class PrepareDataSemeval:
     self.batch_size = batch_size
     self.relation_categories, self.relations = self.read_content()
     self.dictionary = self.build_dictionary()
+    self.matrices = self.build_matrices()
     self.batches = self.build_batches()
-    with open('corpus/semeval_relation_batches.rel', 'wb') as f:
-      pickle.dump(self.batches, f)
+    sentence, primary, secondary, label = self.matrices
+    save_relation_store('corpus/semeval_relation_batches', sentence, label, primary=primary, secondary=secondary)
     print(len(self.relation_categories))
 
   def read_content(self):
@@ -121,41 +123,22 @@ class PrepareDataSemeval:
       file.write('UNK' + ' ' + str(dictionary['UNK']) + '\n')
     return dictionary
 
-  def build_batches(self):
-    batches = []
-    sentence = []
-    primary = []
-    secondary = []
-    label = []
-    base_index = range(self.batch_length, 2 * self.batch_length)
-    for relation_index, relation in enumerate(self.relations,1):
-      words = list(map(lambda w: self.dictionary[w], relation['words']))
-      words += [self.dictionary['BATCH_PAD']] * (self.batch_length - len(words))
-      sentence.append(words)
-      base_index = range(self.batch_length,len(relation['words'])+self.batch_length)
-
-      p = list(map(lambda i: i - relation['primary'], base_index))
-      s = list(map(lambda i: i - relation['secondary'], base_index))
-
-      p.extend([self.dictionary['BATCH_PAD']]*(self.batch_length-len(relation['words'])))
-      s.extend([self.dictionary['BATCH_PAD']] * (self.batch_length - len(relation['words'])))
-
-      primary.append(p)
-      secondary.append(s)
+  def build_matrices(self):
+    sentences = [np.array([self.dictionary[w] for w in relation['words']], np.int32) for relation in self.relations]
+    sentence, primary, secondary = build_relation_matrices(
+      sentences, [relation['primary'] for relation in self.relations],
+      [relation['secondary'] for relation in self.relations], self.batch_length,
+      self.dictionary['BATCH_PAD'], self.batch_length, self.dictionary['BATCH_PAD'])
+    label = np.zeros([len(self.relations), len(self.relation_categories)], np.float32)
+    label[np.arange(len(self.relations)), [relation['type'] for relation in self.relations]] = 1
+    return sentence, primary, secondary, label
 
-      relation_arr = [0]*len(self.relation_categories)
-      relation_arr[relation['type']] = 1
-      label.append(relation_arr)
-
-      if relation_index % self.batch_size == 0:
-        batches.append({'sentence': np.array(sentence, np.int32), 'primary': np.array(primary, np.int32),
-                        'secondary': np.array(secondary, np.int32), 'label': np.array(label, np.float32)})
-        sentence.clear()
-        primary.clear()
-        secondary.clear()
-        label.clear()
-
-    return batches
+  def build_batches(self):
+    sentence, primary, secondary, label = self.matrices
+    count = len(self.relations) - len(self.relations) % self.batch_size
+    return [{'sentence': sentence[i:i + self.batch_size], 'primary': primary[i:i + self.batch_size],
+             'secondary': secondary[i:i + self.batch_size], 'label': label[i:i + self.batch_size]}
+            for i in range(0, count, self.batch_size)]
 
 if __name__ == '__main__':
   sem = PrepareDataSemeval()
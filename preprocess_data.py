@@ -1,92 +1,156 @@
 # -*- coding: UTF-8 -*-
 import numpy as np
 import os
+from base import Base
 from config import CorpusType, TrainMode
 
 
-class PreprocessData:
-  def __init__(self, corpus, mode, type=CorpusType.Train,force_generate=True):
+class RaggedArray:
+  """
+  长度不一的数组依次保存在同一个连续数组中，第i项为values[offsets[i]:offsets[i+1]]
+  rows不为空时每项再变形为rows[i]行，用于按长度分桶的batch，values为内存映射数组时按需读取每一项
+  """
+
+  def __init__(self, values, offsets, rows=None):
+    self.values = values
+    self.offsets = offsets
+    self.rows = rows
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, index):
+    item = self.values[self.offsets[index]:self.offsets[index + 1]]
+    if self.rows is not None:
+      item = item.reshape((self.rows[index], -1) + self.values.shape[1:])
+    return item
+
+  def __iter__(self):
+    for index in range(len(self)):
+      yield self[index]
+
+
+class PreprocessData(Base):
+  def __init__(self, corpus, mode, type=CorpusType.Train,force_generate=True, mmap=False):
+    Base.__init__(self)
     self.skip_window_left = 0
     self.skip_window_right = 1
     self.window_size = self.skip_window_left + self.skip_window_right + 1
     self.dict_path = 'corpus/' + corpus + '_dict.utf8'
     if type == CorpusType.Train:
       self.input_base = 'corpus/' + corpus + '_training'
+      self.output_base = 'corpus/dnn/' + corpus + '_training'
     elif type == CorpusType.Test:
       self.input_base = 'corpus/' + corpus + '_test'
+      self.output_base = 'corpus/dnn/' + corpus + '_test'
+    self.ouput_suffix = '_' + str(self.skip_window_left) + '_' + str(self.skip_window_right)
     if mode == TrainMode.Sentence:
-      self.characters = np.load(self.input_base + '_characters.npy')
-      self.labels = np.load(self.input_base + '_labels.npy')
+      self.input_paths = [self.input_base + '_characters.npy', self.input_base + '_labels.npy']
+      self.output_base += '_sentence'
       self.lengths = np.load(self.input_base + '_lengths.npy')
-      self.character_batches, self.label_batches = self.generate_sentences()
     elif mode == TrainMode.Batch:
-      self.characters = np.load(self.input_base + '_character_batches.npy')
-      self.labels = np.load(self.input_base + '_label_batches.npy')
+      self.input_paths = [self.input_base + '_character_batches.npy', self.input_base + '_label_batches.npy']
       self.lengths = np.load(self.input_base + '_lengths_batches.npy')
-      self.output_base = 'corpus/dnn/' + corpus + '_training'
-      self.ouput_suffix = '_' + str(self.skip_window_left) + '_' + str(self.skip_window_right)
-      if os.path.exists(self.output_base + '_character_batches' + self.ouput_suffix + '.npy') and not force_generate:
-        self.character_batches = np.load(self.output_base + '_character_batches' + self.ouput_suffix + '.npy')
-        self.label_batches = np.load(self.output_base + '_label_batches' + self.ouput_suffix + '.npy')
-      else:
-        self.character_batches, self.label_batches = self.generate_batches()
-        np.save(self.output_base + '_character_batches' + self.ouput_suffix, self.character_batches)
-        np.save(self.output_base + '_label_batches' + self.ouput_suffix, self.label_batches)
     else:
       print('模式错误')
       exit(1)
+    # 生成的窗口逐个写入文件，已经生成且不早于原始数据时直接读取
+    if force_generate or not self.is_generated():
+      # 按长度分桶的batch和句子长度不一，以numpy对象数组保存
+      self.characters, self.labels = [np.load(path, allow_pickle=True) for path in self.input_paths]
+      if mode == TrainMode.Sentence:
+        self.generate_sentences()
+      else:
+        self.generate_batches()
+    # mmap为True时以内存映射方式读取，训练时按需读取每个句子或batch
+    self.character_batches, self.label_batches = self.load_batches('r' if mmap else None)
 
     self.dictionary = self.read_dictionary()
 
-  def read_dictionary(self):
-    dict_file = open(self.dict_path, 'r', encoding='utf-8')
-    dict_content = dict_file.read().splitlines()
-    dictionary = {}
-    dict_arr = map(lambda item: item.split(' '), dict_content)
-    for _, dict_item in enumerate(dict_arr):
-      dictionary[dict_item[0]] = int(dict_item[1])
-    dict_file.close()
+  def output_path(self, name):
+    return self.output_base + name + self.ouput_suffix + '.npy'
+
+  def is_generated(self):
+    output_path = self.output_path('_character_batches')
+    return os.path.exists(output_path) and all(os.path.getmtime(output_path) >= os.path.getmtime(path)
+                                               for path in self.input_paths)
+
+  def load_batches(self, mmap_mode=None):
+    """
+    读取生成的窗口和标签，长度不一时包装为RaggedArray
+    :param mmap_mode: 为'r'时以内存映射方式读取
+    :return: 每个句子或batch的窗口矩阵和标签
+    """
+    character_batches = np.load(self.output_path('_character_batches'), mmap_mode=mmap_mode)
+    label_batches = np.load(self.output_path('_label_batches'), mmap_mode=mmap_mode)
+    self.is_bucket = os.path.exists(self.output_path('_batch_rows'))
+    if not os.path.exists(self.output_path('_batch_offsets')):
+      return character_batches, label_batches
+    offsets = np.load(self.output_path('_batch_offsets'))
+    rows = np.load(self.output_path('_batch_rows')) if self.is_bucket else None
+    return RaggedArray(character_batches, offsets, rows), RaggedArray(label_batches, offsets, rows)
+
+  def generate_windows(self, sentences):
+    """
+    为每个字生成左右各skip_window个字组成的窗口，两端分别以2和3补齐
+    :param sentences: 字索引，最后一维为句子长度
+    :return: 窗口矩阵，比sentences多出最后一维window_size
+    """
+    sentences = np.asarray(sentences, dtype=np.int32)
+    length = sentences.shape[-1]
+    left = np.full(sentences.shape[:-1] + (self.skip_window_left,), 2, dtype=np.int32)
+    right = np.full(sentences.shape[:-1] + (self.skip_window_right,), 3, dtype=np.int32)
+    extend_words = np.concatenate([left, sentences, right], -1)
+    return np.stack([extend_words[..., i:i + length] for i in range(self.window_size)], -1)
 
-    return dictionary
+  def save_ragged(self, sizes, items, rows=None):
+    """
+    将长度不一的窗口矩阵和标签依次写入内存映射文件，另保存每项的偏移，不在内存中构建全部数据
+    :param sizes: 每项的字数
+    :param items: 依次生成每项的窗口矩阵和标签
+    :param rows: 按长度分桶时每个batch的句子数
+    """
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    character_batches = np.lib.format.open_memmap(self.output_path('_character_batches'), mode='w+',
+                                                  dtype=np.int32, shape=(int(offsets[-1]), self.window_size))
+    label_batches = np.lib.format.open_memmap(self.output_path('_label_batches'), mode='w+', dtype=np.int32,
+                                              shape=(int(offsets[-1]),))
+    for index, (character_batch, label_batch) in enumerate(items):
+      character_batches[offsets[index]:offsets[index + 1]] = character_batch.reshape([-1, self.window_size])
+      label_batches[offsets[index]:offsets[index + 1]] = np.ravel(label_batch)
+    character_batches.flush()
+    label_batches.flush()
+    np.save(self.output_path('_batch_offsets'), offsets)
+    if rows is not None:
+      np.save(self.output_path('_batch_rows'), np.asarray(rows, dtype=np.int32))
+    elif os.path.exists(self.output_path('_batch_rows')):
+      os.remove(self.output_path('_batch_rows'))
 
   def generate_sentences(self):
-    characters_batch = []
-    labels_batch = []
-    for i, sentence_words in enumerate(self.characters):
-      if len(sentence_words) < max(self.skip_window_left, self.skip_window_right):
-        continue
-      extend_words = [2] * self.skip_window_left
-      extend_words.extend(sentence_words)
-      extend_words.extend([3] * self.skip_window_right)
-      word_batch = list(
-        map(lambda item: extend_words[item[0] - self.skip_window_left:item[0] + self.skip_window_right + 1],
-            enumerate(extend_words[self.skip_window_left:-self.skip_window_right], self.skip_window_left)))
-      characters_batch.append(np.array(word_batch, dtype=np.int32))
-      labels_batch.append(np.array(self.labels[i], dtype=np.int32))
-    #print(characters_batch)
-    return np.array(characters_batch), np.array(labels_batch)
+    # 句子长度不一，所有句子的窗口依次写入同一个数组
+    indices = [i for i, sentence_words in enumerate(self.characters)
+               if len(sentence_words) >= max(self.skip_window_left, self.skip_window_right)]
+    items = ((self.generate_windows(self.characters[i]), np.asarray(self.labels[i], dtype=np.int32))
+             for i in indices)
+    self.save_ragged([len(self.characters[i]) for i in indices], items)
 
   def generate_batches(self):
-    character_batches = []
-    label_batches = []
+    if self.characters.dtype == object:
+      # 按长度分桶的batch只补齐到各自最长的句子，与句子一样依次写入同一个数组
+      items = ((self.generate_windows(batch), np.asarray(self.labels[i], dtype=np.int32))
+               for i, batch in enumerate(self.characters))
+      self.save_ragged([np.size(batch) for batch in self.characters], items,
+                       rows=[len(batch) for batch in self.characters])
+      return
+    character_batches = np.lib.format.open_memmap(self.output_path('_character_batches'), mode='w+',
+                                                  dtype=np.int32, shape=self.characters.shape + (self.window_size,))
+    label_batches = np.lib.format.open_memmap(self.output_path('_label_batches'), mode='w+', dtype=np.int32,
+                                              shape=self.labels.shape)
     for batch_index, batch in enumerate(self.characters):
-      character_batch = []
-      label_batch = []
-      for sentence_index, sentence in enumerate(batch):
-        extend_words = [2] * self.skip_window_left
-        extend_words.extend(sentence)
-        extend_words.extend([3] * self.skip_window_right)
-        if self.skip_window_right != 0:
-          word_batch = list(
-            map(lambda item: extend_words[item[0] - self.skip_window_left:item[0] + self.skip_window_right + 1],
-                enumerate(extend_words[self.skip_window_left:-self.skip_window_right], self.skip_window_left)))
-        else:
-          word_batch = list(
-            map(lambda item: extend_words[item[0] - self.skip_window_left:item[0] + self.skip_window_right + 1],
-                enumerate(extend_words[self.skip_window_left:], self.skip_window_left)))
-        character_batch.append(word_batch)
-        label_batch.append(self.labels[batch_index][sentence_index])
-      character_batches.append(character_batch)
-      label_batches.append(label_batch)
-
-    return np.array(character_batches, dtype=np.int32), np.array(label_batches, dtype=np.int32)
+      character_batches[batch_index] = self.generate_windows(batch)
+      label_batches[batch_index] = self.labels[batch_index]
+    character_batches.flush()
+    label_batches.flush()
+    for name in ['_batch_offsets', '_batch_rows']:
+      if os.path.exists(self.output_path(name)):
+        os.remove(self.output_path(name))
@@ -1,12 +1,17 @@
 # -*- coding: UTF-8 -*-
 import numpy as np
 import tensorflow as tf
-import pickle
+import time
+from base import Base
+from export_model import export_inference, load_inference, quantized_variable, dequantize_lookup
+from relation_store import RelationStore
 
 
-class RECNN():
-  def __init__(self, relation_count=2, window_size=(3,), batch_size=50, batch_length=85,train=True):
+class RECNN(Base):
+  def __init__(self, relation_count=2, window_size=(3,), batch_size=50, batch_length=85,train=True,
+               is_shared=False, is_dynamic=False, is_conv1d=False, is_quantized=False):
     tf.reset_default_graph()
+    Base.__init__(self)
     self.dtype = tf.float32
     self.window_size = window_size
     self.filter_size = 150
@@ -22,46 +27,89 @@ class RECNN():
     self.dictionary = self.read_dictionary()
     self.words_size = len(self.dictionary)
     self.is_train = train
+    # 同一句子的多个实体对共享字向量部分的卷积结果
+    self.is_shared = is_shared
+    # 句子长度不固定，每个batch只补齐到其中最长的句子，池化时忽略补齐的位置，batch_length只用于位置向量
+    self.is_dynamic = is_dynamic
+    # 拼接的向量作为通道进行一维卷积，参数与二维卷积相同
+    self.is_conv1d = is_conv1d
+    # 预测时字向量保存为按行量化的int8，查表后再还原为浮点数，只能加载export_inference导出的量化模型
+    self.is_quantized = is_quantized
+    if self.is_quantized and self.is_train:
+      raise Exception('quantized model can only be used for prediction')
     if relation_count == 2:
-      self.batch_path = 'corpus/emr_all_relation_batches.rel'
+      self.batch_path = 'corpus/emr_all_relation_batches'
       self.output_folder = 'tmp/re_two/'
-      self.test_batch_path = 'corpus/emr_test_all_relations.rel'
+      self.test_batch_path = 'corpus/emr_test_all_relations'
     elif relation_count == 29:
-      self.batch_path = 'corpus/emr_relation_batches.rel'
+      self.batch_path = 'corpus/emr_relation_batches'
       self.output_folder = 'tmp/re_multi/'
-      self.test_batch_path = 'corpus/emr_test_relations.rel'
+      self.test_batch_path = 'corpus/emr_test_relations'
     else:
       raise Exception('relation count error')
+    if self.is_dynamic:
+      self.batch_path += '_dynamic'
+      self.test_batch_path += '_dynamic'
+    input_length = None if self.is_dynamic else self.batch_length
 
     self.concat_embed_size = self.character_embed_size + 2 * self.position_embed_size
-    self.input_characters = tf.placeholder(tf.int32, [None, self.batch_length])
-    self.input_position = tf.placeholder(tf.int32, [None, self.batch_length])
-    self.input = tf.placeholder(self.dtype, [None, self.batch_length, self.concat_embed_size, 1])
+    self.input_characters = tf.placeholder(tf.int32, [None, input_length], name='input_characters')
+    # 只传入两个实体在句子中的位置时，在计算图中计算每个字的相对位置，也可以直接传入相对位置
+    self.input_primary_index = tf.placeholder(tf.int32, [None], name='input_primary_index')
+    self.input_secondary_index = tf.placeholder(tf.int32, [None], name='input_secondary_index')
+    self.input_position = tf.placeholder_with_default(self.relative_position(self.input_primary_index),
+                                                      [None, input_length], name='input_position')
+    self.input_secondary_position = tf.placeholder_with_default(
+      self.relative_position(self.input_secondary_index), [None, input_length], name='input_secondary_position')
+    position_shape = tf.shape(self.input_position)
+    self.input_length = tf.placeholder_with_default(tf.fill([position_shape[0]], position_shape[1]), [None],
+                                                    name='input_length')
+    # 共享卷积时input_characters为batch内去重后的句子，每个实体对通过该索引对应到句子
+    self.input_sentence_index = tf.placeholder(tf.int32, [None], name='input_sentence_index')
     self.input_relation = tf.placeholder(self.dtype, [None, self.relation_count])
-    self.position_embedding = self.weight_variable([2 * self.batch_length, self.position_embed_size])
-    self.character_embedding = self.weight_variable([self.words_size, self.character_embed_size])
+    # 参数显式命名，导出和加载预测模型时按变量名对应，量化参数的缩放系数也按变量名保存
+    self.position_embedding = self.weight_variable([2 * self.batch_length, self.position_embed_size],
+                                                   'position_embedding')
+    if self.is_quantized:
+      self.character_embedding, self.character_embedding_scale = quantized_variable(
+        [self.words_size, self.character_embed_size], self.dtype, name='character_embedding')
+    else:
+      self.character_embedding = self.weight_variable([self.words_size, self.character_embed_size],
+                                                      'character_embedding')
     self.conv_kernel = self.get_conv_kernel()
-    self.bias = [self.weight_variable([self.filter_size])] * len(self.window_size)
-    self.full_connected_weight = self.weight_variable([self.filter_size*len(self.window_size), self.relation_count])
-    self.full_connected_bias = self.weight_variable([self.relation_count])
-    self.position_lookup = tf.nn.embedding_lookup(self.position_embedding, self.input_position)
-    self.character_lookup = tf.nn.embedding_lookup(self.character_embedding, self.input_characters)
-    self.character_embed_holder = tf.placeholder(self.dtype,
-                                                 [None, self.batch_length, self.character_embed_size])
-    self.primary_embed_holder = tf.placeholder(self.dtype,
-                                               [None, self.batch_length, self.position_embed_size])
-    self.secondary_embed_holder = tf.placeholder(self.dtype,
-                                                 [None, self.batch_length, self.position_embed_size])
-    self.emebd_concat = tf.expand_dims(
-      tf.concat([self.character_embed_holder, self.primary_embed_holder, self.secondary_embed_holder], 2), 3)
-    if train:
-      self.hidden_layer = tf.layers.dropout(self.get_hidden(), self.dropout_rate)
+    self.bias = [self.weight_variable([self.filter_size], 'conv_bias')] * len(self.window_size)
+    self.full_connected_weight = self.weight_variable([self.filter_size*len(self.window_size), self.relation_count],
+                                                      'full_connected_weight')
+    self.full_connected_bias = self.weight_variable([self.relation_count], 'full_connected_bias')
+    primary_position, secondary_position = self.input_position, self.input_secondary_position
+    if self.is_dynamic:
+      # 超过batch_length的长句子，较远的相对位置使用最远的位置向量
+      primary_position = tf.clip_by_value(primary_position, 0, 2 * self.batch_length - 1)
+      secondary_position = tf.clip_by_value(secondary_position, 0, 2 * self.batch_length - 1)
+    self.position_lookup = tf.nn.embedding_lookup(self.position_embedding, primary_position,
+                                                  name='position_lookup')
+    self.secondary_position_lookup = tf.nn.embedding_lookup(self.position_embedding, secondary_position)
+    if self.is_quantized:
+      self.character_lookup = dequantize_lookup(self.character_embedding, self.character_embedding_scale,
+                                                self.input_characters, name='character_lookup')
     else:
-      self.hidden_layer = tf.expand_dims(tf.layers.dropout(self.get_hidden(), self.dropout_rate),0)
+      self.character_lookup = tf.nn.embedding_lookup(self.character_embedding, self.input_characters,
+                                                     name='character_lookup')
+    # 由字和位置的索引直接在计算图中查表和拼接，每个batch只需一次sess.run
+    self.emebd_concat = tf.expand_dims(
+      tf.concat([self.character_lookup, self.position_lookup, self.secondary_position_lookup], 2), 3)
+    # 也可以直接传入拼接好的向量
+    if not self.is_shared:
+      self.input = tf.placeholder_with_default(self.emebd_concat,
+                                               [None, input_length, self.concat_embed_size, 1], name='input')
+    self.hidden_layer = tf.layers.dropout(self.get_hidden(), self.dropout_rate)
     self.output_no_softmax = tf.matmul(self.hidden_layer, self.full_connected_weight) + self.full_connected_bias
-    self.output = tf.nn.softmax(tf.matmul(self.hidden_layer, self.full_connected_weight) + self.full_connected_bias)
-    self.params = [self.position_embedding, self.character_embedding, self.full_connected_weight,
+    self.output = tf.nn.softmax(tf.matmul(self.hidden_layer, self.full_connected_weight) + self.full_connected_bias,
+                                name='output')
+    self.params = [self.position_embedding, self.full_connected_weight,
                    self.full_connected_bias] + self.conv_kernel + self.bias
+    if not self.is_quantized:
+      self.params.append(self.character_embedding)
     self.regularization = tf.contrib.layers.apply_regularization(tf.contrib.layers.l2_regularizer(self.lam),
                                                                  self.params)
     self.loss = tf.reduce_sum(tf.square(self.output - self.input_relation)) / self.batch_size + self.regularization
@@ -73,14 +121,20 @@ class RECNN():
     self.train_cross_entropy_model = self.optimizer.minimize(self.cross_entropy)
     self.saver = tf.train.Saver(max_to_keep=100)
 
-  def weight_variable(self, shape):
+  def relative_position(self, entity_index):
+    # 与PrepareDataNer中一致，第i个字的位置索引为batch_length - 1 + i - 实体位置，补齐的位置继续递增
+    positions = tf.range(tf.shape(self.input_characters)[1]) + self.batch_length - 1
+    return tf.expand_dims(positions, 0) - tf.expand_dims(entity_index, 1)
+
+  def weight_variable(self, shape, name=None):
     initial = tf.truncated_normal(shape, stddev=0.1, dtype=self.dtype)
-    return tf.Variable(initial)
+    return tf.Variable(initial, name=name)
 
   def get_conv_kernel(self):
     conv_kernel = []
     for w in self.window_size:
-      conv_kernel.append(self.weight_variable([w, self.concat_embed_size, 1, self.filter_size]))
+      conv_kernel.append(self.weight_variable([w, self.concat_embed_size, 1, self.filter_size],
+                                              'conv_kernel_' + str(w)))
     return conv_kernel
 
   def get_max_pooling(self, x):
@@ -90,98 +144,202 @@ class RECNN():
     return max_pooling
 
   def get_hidden(self):
-    h = None
+    if self.is_conv1d:
+      return self.get_hidden_1d()
+    # 只去掉池化后长度为1的维度，batch大小为1时也保持batch*filter_size的形状
+    h = []
     for w, conv, bias in zip(self.window_size, self.conv_kernel, self.bias):
-      if h is None:
-        h = tf.squeeze(self.max_pooling(tf.nn.relu(self.conv(conv) + bias), w))
-      else:
-        hh = tf.squeeze(self.max_pooling(tf.nn.relu(self.conv(conv) + bias), w))
-        if self.is_train:
-          h = tf.concat([h, hh], 1)
-        else:
-          h = tf.concat([h,hh], 0)
-    return h
+      h.append(tf.squeeze(self.max_pooling(tf.nn.relu(self.conv(conv) + bias), w), [1, 2]))
+    return tf.concat(h, 1)
+
+  def get_hidden_1d(self):
+    """
+    所有窗口大小的卷积核在后面补0到最大的窗口大小后按输出通道合并，只进行一次一维卷积
+    """
+    max_window, min_window = max(self.window_size), min(self.window_size)
+    kernel = tf.concat([tf.pad(tf.reshape(k, [w, self.concat_embed_size, self.filter_size]),
+                               [[0, max_window - w], [0, 0], [0, 0]])
+                        for w, k in zip(self.window_size, self.conv_kernel)], 2)
+    bias = tf.concat(self.bias, 0)
+    # 句尾补0使较小的窗口也能计算到最后一个位置
+    padding = max_window - min_window
+    if self.is_shared:
+      character_conv = self.conv1d(self.character_lookup, kernel[:, :self.character_embed_size], padding)
+      position_embeds = tf.concat([self.position_lookup, self.secondary_position_lookup], 2)
+      conv = tf.gather(character_conv, self.input_sentence_index) + self.conv1d(
+        position_embeds, kernel[:, self.character_embed_size:], padding)
+    else:
+      conv = self.conv1d(tf.squeeze(self.input, [3]), kernel, padding)
+    x = tf.nn.relu(conv + bias)
+    h = []
+    for i, w in enumerate(self.window_size):
+      h.append(self.max_pooling_1d(x[:, :, i * self.filter_size:(i + 1) * self.filter_size], w))
+    return tf.concat(h, 1)
+
+  def conv1d(self, x, kernel, padding):
+    x = tf.pad(x, [[0, 0], [0, padding], [0, 0]])
+    return tf.nn.conv1d(x, kernel, 1, 'VALID')
+
+  def max_pooling_1d(self, x, window_size):
+    # 只取窗口不超出句子的位置，relu之后的值非负，其它位置置0不影响最大值
+    x_shape = tf.shape(x)
+    mask = tf.sequence_mask(tf.maximum(self.input_length - window_size + 1, 1), x_shape[1], dtype=self.dtype)
+    return tf.reduce_max(x * tf.expand_dims(mask, 2), 1)
 
   def conv(self, conv_kernel):
+    if self.is_shared:
+      return self.shared_conv(conv_kernel)
     return tf.nn.conv2d(self.input, conv_kernel, strides=[1, 1, 1, 1], padding='VALID')
 
+  def shared_conv(self, conv_kernel):
+    """
+    卷积核按字向量和位置向量拆分，字向量部分每个句子只计算一次，再按实体对取出并加上位置向量部分的卷积
+    """
+    character_kernel = conv_kernel[:, :self.character_embed_size]
+    position_kernel = conv_kernel[:, self.character_embed_size:]
+    character_conv = tf.nn.conv2d(tf.expand_dims(self.character_lookup, 3), character_kernel,
+                                  strides=[1, 1, 1, 1], padding='VALID')
+    position_embeds = tf.expand_dims(tf.concat([self.position_lookup, self.secondary_position_lookup], 2), 3)
+    position_conv = tf.nn.conv2d(position_embeds, position_kernel, strides=[1, 1, 1, 1], padding='VALID')
+    return tf.gather(character_conv, self.input_sentence_index) + position_conv
+
   def max_pooling(self, x, window_size):
+    if self.is_dynamic:
+      # 补齐位置的卷积结果置0，relu之后的值非负，不影响最大值
+      x_shape = tf.shape(x)
+      mask = tf.sequence_mask(tf.maximum(self.input_length - window_size + 1, 1), x_shape[1], dtype=self.dtype)
+      return tf.reduce_max(x * tf.reshape(mask, [x_shape[0], -1, 1, 1]), 1, keepdims=True)
     return tf.nn.max_pool(x, ksize=[1, self.batch_length - window_size + 1, 1, 1],
                           strides=[1, 1, 1, 1], padding='VALID')
 
   def train(self):
-    batches = self.load_batches(self.batch_path)
+    store = self.load_batches(self.batch_path)
     with tf.Session() as sess:
       tf.global_variables_initializer().run()
       sess.graph.finalize()
       epochs = 100
       for i in range(1, epochs + 1):
         print('epoch:' + str(i))
-        for batch in batches:
-          character_embeds, primary_embeds = sess.run([self.character_lookup, self.position_lookup],
-                                                      feed_dict={self.input_characters: batch['sentence'],
-                                                                 self.input_position: batch['primary']})
-          secondary_embeds = sess.run(self.position_lookup, feed_dict={self.input_position: batch['secondary']})
-          input = sess.run(self.emebd_concat, feed_dict={self.character_embed_holder: character_embeds,
-                                                         self.primary_embed_holder: primary_embeds,
-                                                         self.secondary_embed_holder: secondary_embeds})
-          # sess.run(self.train_model, feed_dict={self.input: input, self.input_relation: batch['label']})
-          sess.run(self.train_cross_entropy_model, feed_dict={self.input: input, self.input_relation: batch['label']})
+        for batch in self.read_batches(store, drop_remainder=True):
+          feed_dict = self.get_batch_feed_dict(batch)
+          feed_dict[self.input_relation] = batch['label']
+          # sess.run(self.train_model, feed_dict)
+          sess.run(self.train_cross_entropy_model, feed_dict)
         if i % 50 == 0:
           model_name = 'cnn_emr_model{0}_{1}.ckpt'.format(i, '_'.join(map(str, self.window_size)))
           self.saver.save(sess, self.output_folder + model_name)
 
+  def get_feed_dict(self, sentences, primary_indices, secondary_indices, lengths=None):
+    """
+    :param primary_indices: 每个字相对第一个实体的位置，或每个实体对中第一个实体在句子中的位置
+    :param secondary_indices: 同primary_indices，对应第二个实体
+    """
+    if np.ndim(primary_indices[0]) == 0:
+      feed_dict = {self.input_characters: sentences, self.input_primary_index: primary_indices,
+                   self.input_secondary_index: secondary_indices}
+    else:
+      feed_dict = {self.input_characters: sentences, self.input_position: primary_indices,
+                   self.input_secondary_position: secondary_indices}
+    if self.is_shared:
+      sentences, sentence_index = np.unique(sentences, axis=0, return_inverse=True)
+      feed_dict[self.input_characters] = sentences
+      feed_dict[self.input_sentence_index] = sentence_index.reshape([-1])
+    if lengths is not None:
+      feed_dict[self.input_length] = lengths
+    return feed_dict
+
+  def get_batch_feed_dict(self, batch):
+    if 'primary_index' in batch:
+      return self.get_feed_dict(batch['sentence'], batch['primary_index'], batch['secondary_index'],
+                                batch.get('length'))
+    return self.get_feed_dict(batch['sentence'], batch['primary'], batch['secondary'], batch.get('length'))
+
+  def pad_batch(self, sentences, primary_indices, secondary_indices):
+    """
+    将长度不一的实体对补齐到其中最长句子的长度，至少补齐到最大的卷积窗口
+    :return: 补齐后的字索引、两个位置索引和每个句子的实际长度，传入实体位置时实体位置不变
+    """
+    lengths = np.array([len(s) for s in sentences], np.int32)
+    mask = np.arange(max(lengths.max(), max(self.window_size))) < lengths[:, None]
+    sentence_batch = np.full(mask.shape, self.dictionary['BATCH_PAD'], np.int32)
+    sentence_batch[mask] = np.concatenate(sentences)
+    if np.ndim(primary_indices[0]) == 0:
+      return sentence_batch, primary_indices, secondary_indices, lengths
+    primary_batch = np.zeros(mask.shape, np.int32)
+    secondary_batch = np.zeros(mask.shape, np.int32)
+    primary_batch[mask] = np.concatenate(primary_indices)
+    secondary_batch[mask] = np.concatenate(secondary_indices)
+    return sentence_batch, primary_batch, secondary_batch, lengths
+
   def load_batches(self, path):
-    with open(path, 'rb') as f:
-      batches = pickle.load(f)
-      return batches
-
-  def read_dictionary(self):
-    dict_file = open(self.dict_path, 'r', encoding='utf-8')
-    dict_content = dict_file.read().splitlines()
-    dictionary = {}
-    dict_arr = map(lambda item: item.split(' '), dict_content)
-    for _, dict_item in enumerate(dict_arr):
-      dictionary[dict_item[0]] = int(dict_item[1])
-    dict_file.close()
-    return dictionary
-
-  def predict(self, sentences, primary_indies, secondary_indices):
+    return RelationStore(path)
+
+  def read_batches(self, store, drop_remainder=False):
+    # 长度不一时补齐到batch内最长的句子，且不小于最大的卷积窗口
+    return store.batches(self.batch_size, pad=self.dictionary['BATCH_PAD'], min_length=max(self.window_size),
+                         drop_remainder=drop_remainder)
+
+  def predict_batches(self, sess, sentences, primary_indices, secondary_indices):
+    """
+    按batch_size分组计算任意数量的实体对，每组运行一次计算图
+    is_dynamic为True时输入为长度不一的索引列表，每组只补齐到其中最长的句子
+    :return: 每个实体对属于各关系的概率
+    """
+    outputs = []
+    for start in range(0, len(sentences), self.batch_size):
+      end = start + self.batch_size
+      if self.is_dynamic:
+        feed_dict = self.get_feed_dict(*self.pad_batch(sentences[start:end], primary_indices[start:end],
+                                                       secondary_indices[start:end]))
+      else:
+        feed_dict = self.get_feed_dict(sentences[start:end], primary_indices[start:end],
+                                       secondary_indices[start:end])
+      outputs.append(sess.run(self.output, feed_dict=feed_dict))
+    if len(outputs) == 0:
+      return np.zeros([0, self.relation_count], dtype=np.float32)
+    return np.concatenate(outputs)
+
+  def predict(self, sentences, primary_indies, secondary_indices, model_file='cnn_emr_model3.ckpt'):
     with tf.Session() as sess:
-      self.saver.restore(sess, self.output_folder + 'cnn_emr_model3.ckpt')
-      character_embeds, primary_embeds = sess.run([self.character_lookup, self.position_lookup],
-                                                  feed_dict={self.input_characters: sentences,
-                                                             self.input_position: primary_indies})
-      secondary_embeds = sess.run(self.position_lookup, feed_dict={self.input_position: secondary_indices})
-      input = sess.run(self.emebd_concat, feed_dict={self.character_embed_holder: character_embeds,
-                                                     self.primary_embed_holder: primary_embeds,
-                                                     self.secondary_embed_holder: secondary_embeds})
-      output = sess.run(self.output, feed_dict={self.input: input})
+      self.saver.restore(sess, self.output_folder + model_file)
+      output = self.predict_batches(sess, sentences, primary_indies, secondary_indices)
       return np.argmax(output, 1)
 
+  def export_inference(self, model_file, export_path, is_half=False, is_frozen=False, is_quantized=False):
+    """
+    导出只包含前向计算参数的预测模型，不包含优化器的变量
+    冻结的计算图输入为input_characters和input_primary_index、input_secondary_index（或input_position、
+    input_secondary_position），输出为output
+    :param is_quantized: 是否将字向量和全连接层的权重按行量化为int8，以is_quantized=True构建的RECNN加载后字向量在内存中仍为int8
+    """
+    if is_quantized:
+      quantized_variables = [self.character_embedding, self.full_connected_weight]
+    else:
+      quantized_variables = []
+    with tf.Session() as sess:
+      self.saver.restore(sess, self.output_folder + model_file)
+      export_inference(sess, export_path,
+                       [self.output.op.name],
+                       is_half, is_frozen, quantized_variables)
+
   def evaluate(self, model_file):
     #tf.reset_default_graph()
     with tf.Session() as sess:
       #tf.global_variables_initializer().run()
 
       self.saver.restore(sess=sess, save_path=self.output_folder + model_file)
-      items = self.load_batches(self.test_batch_path)
+      store = self.load_batches(self.test_batch_path)
       corr_count = [0] * self.relation_count
       prec_count = [0] * self.relation_count
       recall_count = [0] * self.relation_count
 
-      for item in items:
-        character_embeds, primary_embeds = sess.run([self.character_lookup, self.position_lookup],
-                                                    feed_dict={self.input_characters: item['sentence'],
-                                                               self.input_position: item['primary']})
-        secondary_embeds = sess.run(self.position_lookup, feed_dict={self.input_position: item['secondary']})
-        input = sess.run(self.emebd_concat, feed_dict={self.character_embed_holder: character_embeds,
-                                                       self.primary_embed_holder: primary_embeds,
-                                                       self.secondary_embed_holder: secondary_embeds})
-        # print(input)
-        output = np.squeeze(sess.run(self.output, feed_dict={self.input: input}))
-        target = np.argmax(item['label'])
-        current = np.argmax(output)
+      outputs = []
+      for batch in self.read_batches(store):
+        feed_dict = self.get_batch_feed_dict(batch)
+        outputs.append(sess.run(self.output, feed_dict=feed_dict))
+      outputs = np.concatenate(outputs)
+      targets = np.argmax(store.label, 1)
+      for target, current in zip(targets, np.argmax(outputs, 1)):
         if target == current:
           corr_count[target] += 1
         prec_count[current] += 1
@@ -201,6 +359,36 @@ class RECNN():
     print('recall:', recall)
     print('f1',f1)
 
+class REPredictor:
+  """
+  常驻的关系抽取预测器，模型只加载一次，之后可以对任意数量的实体对分batch预测
+  """
+
+  def __init__(self, model_path, relation_count=2, window_size=(3,), batch_size=50, is_inference=False,
+               is_shared=True, is_dynamic=False, is_quantized=False):
+    # is_quantized为True时model_path为以is_quantized=True导出的预测模型，字向量以int8常驻内存
+    if is_quantized and not is_inference:
+      raise Exception('quantized model must be an exported inference model')
+    self.re = RECNN(relation_count, window_size=window_size, batch_size=batch_size, train=False,
+                    is_shared=is_shared, is_dynamic=is_dynamic, is_quantized=is_quantized)
+    self.sess = tf.Session()
+    # is_inference为True时model_path为export_inference导出的预测模型
+    if is_inference:
+      load_inference(self.sess, model_path)
+    else:
+      self.re.saver.restore(self.sess, model_path)
+
+  def predict(self, sentences, primary_indices, secondary_indices):
+    """
+    :param sentences: 每个实体对所在句子的字索引，count*batch_length，is_dynamic为True时为长度不一的列表
+    :param primary_indices: 每个字相对第一个实体的位置，形状同sentences，也可以只传入第一个实体在句子中的位置
+    :param secondary_indices: 每个字相对第二个实体的位置，形状同primary_indices
+    :return: 每个实体对的关系标签和各关系的概率
+    """
+    output = self.re.predict_batches(self.sess, sentences, primary_indices, secondary_indices)
+    return np.argmax(output, 1), output
+
+
 def train_two():
   re_2 = RECNN(window_size=(2,))
   re_2.train()
@@ -229,6 +417,36 @@ def train_multi():
   re_2_3_4 = RECNN(window_size=(2, 3, 4),relation_count=29)
   re_2_3_4.train()
 
+def benchmark_conv1d(count=2000, checkpoint='tmp/re_benchmark.ckpt'):
+  """
+  比较二维卷积和一维卷积两种实现的速度，一维卷积加载二维卷积的模型参数，输出应相同
+  """
+  window_size = [(2,), (3,), (4,), (2, 3), (3, 4), (2, 3, 4)]
+  for w in window_size:
+    re_2d = RECNN(2, window_size=w, train=False)
+    sentences = np.random.randint(0, re_2d.words_size, [count, re_2d.batch_length]).astype(np.int32)
+    primary = np.random.randint(0, 2 * re_2d.batch_length, [count, re_2d.batch_length]).astype(np.int32)
+    secondary = np.random.randint(0, 2 * re_2d.batch_length, [count, re_2d.batch_length]).astype(np.int32)
+    with tf.Session() as sess:
+      tf.global_variables_initializer().run()
+      re_2d.saver.save(sess, checkpoint)
+      re_2d.predict_batches(sess, sentences[:re_2d.batch_size], primary[:re_2d.batch_size],
+                            secondary[:re_2d.batch_size])
+      start = time.time()
+      output_2d = re_2d.predict_batches(sess, sentences, primary, secondary)
+      time_2d = time.time() - start
+    re_1d = RECNN(2, window_size=w, train=False, is_conv1d=True)
+    with tf.Session() as sess:
+      re_1d.saver.restore(sess, checkpoint)
+      re_1d.predict_batches(sess, sentences[:re_1d.batch_size], primary[:re_1d.batch_size],
+                            secondary[:re_1d.batch_size])
+      start = time.time()
+      output_1d = re_1d.predict_batches(sess, sentences, primary, secondary)
+      time_1d = time.time() - start
+    print('window size:', w)
+    print('conv2d: %.3fs conv1d: %.3fs max diff: %g' % (time_2d, time_1d, np.abs(output_2d - output_1d).max()))
+
+
 if __name__ == '__main__':
   train_two()
   train_multi()
@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+import os
+import numpy as np
+
+COLUMNS = ['sentence', 'primary', 'secondary']
+INDEX_COLUMNS = ['primary_index', 'secondary_index']
+
+
+def flatten_column(column, lengths):
+  # 矩阵按每行的实际长度取出，长度不一的列表直接拼接
+  if isinstance(column, np.ndarray) and column.ndim == 2:
+    return column[np.arange(column.shape[1]) < lengths[:, None]]
+  return np.concatenate(list(column) + [np.zeros([0], np.int32)])
+
+
+def save_relation_store(base_path, sentences, labels, lengths=None, primary=None, secondary=None,
+                        primary_index=None, secondary_index=None):
+  """
+  将所有实体对按列保存，每列用一次拼接写为连续的数组，另保存每个实体对的偏移和标签
+  相对位置可以按字保存primary、secondary，也可以只保存两个实体的位置primary_index、secondary_index
+  :param base_path: 保存路径的前缀，每列保存为base_path + '_列名.npy'
+  :param sentences: 字索引矩阵count*width，或长度不一的字索引列表
+  :param labels: 每个实体对的标签，count*relation_count
+  :param lengths: sentences为矩阵时每行的实际长度，为None时保存整行
+  :param primary: 每个字相对第一个实体的位置，形状同sentences
+  :param secondary: 每个字相对第二个实体的位置，形状同sentences
+  :param primary_index: 第一个实体在句子中的位置
+  :param secondary_index: 第二个实体在句子中的位置
+  """
+  if isinstance(sentences, np.ndarray) and sentences.ndim == 2:
+    if lengths is None:
+      lengths = np.full([len(sentences)], sentences.shape[1], np.int32)
+  else:
+    lengths = np.array([len(s) for s in sentences], np.int32)
+  lengths = np.asarray(lengths, np.int32)
+  columns = {'sentence': sentences}
+  if primary_index is None:
+    columns['primary'] = primary
+    columns['secondary'] = secondary
+  for column, value in columns.items():
+    np.save(base_path + '_' + column, flatten_column(value, lengths).astype(np.int32))
+  if primary_index is not None:
+    np.save(base_path + '_primary_index', np.asarray(primary_index, np.int32))
+    np.save(base_path + '_secondary_index', np.asarray(secondary_index, np.int32))
+  np.save(base_path + '_label', np.asarray(labels, np.float32))
+  np.save(base_path + '_offsets', np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+
+
+class RelationStore:
+  """
+  按列保存的关系数据，以mmap方式打开，读取时再按batch大小分组
+  """
+
+  def __init__(self, base_path):
+    # 只保存了实体位置时，读取的batch中为'primary_index'和'secondary_index'
+    self.is_index = os.path.exists(base_path + '_primary_index.npy')
+    if self.is_index:
+      self.index_columns = {column: np.load(base_path + '_' + column + '.npy', mmap_mode='r')
+                            for column in INDEX_COLUMNS}
+      columns = COLUMNS[:1]
+    else:
+      columns = COLUMNS
+    self.columns = {column: np.load(base_path + '_' + column + '.npy', mmap_mode='r') for column in columns}
+    self.label = np.load(base_path + '_label.npy', mmap_mode='r')
+    self.offsets = np.load(base_path + '_offsets.npy')
+    self.lengths = np.diff(self.offsets).astype(np.int32)
+
+  def __len__(self):
+    return len(self.lengths)
+
+  def get_batch(self, start, end, pad=0, min_length=0):
+    """
+    读取第start到end个实体对，长度相同时直接由mmap数组切片得到，否则补齐到其中最长句子的长度
+    :param pad: 补齐的字索引
+    :param min_length: 补齐的最小长度
+    :return: 与原batch格式相同的字典，长度不同时另有'length'，只保存了实体位置时以实体位置代替位置索引
+    """
+    lengths = self.lengths[start:end]
+    begin, finish = self.offsets[start], self.offsets[end]
+    batch = {'label': self.label[start:end]}
+    if self.is_index:
+      for column in INDEX_COLUMNS:
+        batch[column] = self.index_columns[column][start:end]
+    if lengths.min() == lengths.max() and lengths[0] >= min_length:
+      for column in self.columns:
+        batch[column] = self.columns[column][begin:finish].reshape([len(lengths), -1])
+      return batch
+    mask = np.arange(max(lengths.max(), min_length)) < lengths[:, None]
+    for column in self.columns:
+      batch[column] = np.full(mask.shape, pad if column == 'sentence' else 0, np.int32)
+      batch[column][mask] = self.columns[column][begin:finish]
+    batch['length'] = lengths
+    return batch
+
+  def batches(self, batch_size, pad=0, min_length=0, drop_remainder=False):
+    count = len(self)
+    if drop_remainder:
+      count -= count % batch_size
+    for start in range(0, count, batch_size):
+      yield self.get_batch(start, min(start + batch_size, count), pad, min_length)
@@ -2,36 +2,307 @@ from unittest import TestCase
 import numpy as np
 from dnn_base import DNNBase
 
+
+CONSTRAINTS = {'cws': ([[0, 1], [2, 3], [2, 3], [0, 1]], [0, 1]),
+               'ner': ([[0, 1], [0, 1, 2], [0, 1, 2]], [0, 1])}
+
+
+def viterbi_loop(dnn_base, emission, A, init_A, is_constraint=False, labels=None):
+  """
+  原三重循环实现的维特比算法，作为向量化实现的对照
+  """
+  constraint, init_constraint = CONSTRAINTS[dnn_base.task]
+  length = emission.shape[1]
+  path = np.ones([dnn_base.tags_count, length], dtype=np.int32) * -1
+  corr_path = np.zeros([length], dtype=np.int32)
+  path_score = np.ones([dnn_base.tags_count, length], dtype=np.float64) * (np.finfo('f').min / 2)
+  path_score[:, 0] = init_A + emission[:, 0]
+  if is_constraint:
+    for i in range(dnn_base.tags_count):
+      if i not in init_constraint:
+        path_score[i, 0] = -np.inf
+
+  if labels is not None:
+    for i in range(dnn_base.tags_count):
+      if i != labels[0]:
+        path_score[i, 0] += dnn_base.hinge_discount
+
+  for pos in range(1, length):
+    for t in range(dnn_base.tags_count):
+      for prev in range(dnn_base.tags_count):
+        if is_constraint:
+          if t not in constraint[prev]:
+            continue
+        temp = path_score[prev][pos - 1] + A[prev][t] + emission[t][pos]
+        if labels is not None:
+          if t != labels[pos]:
+            temp += dnn_base.hinge_discount
+        if temp >= path_score[t][pos]:
+          path[t][pos] = prev
+          path_score[t][pos] = temp
+
+  max_index = np.argmax(path_score[:, -1])
+  best_score = path_score[max_index, -1]
+  corr_path[length - 1] = max_index
+  for i in range(length - 1, 0, -1):
+    max_index = path[max_index][i]
+    corr_path[i - 1] = max_index
+  return corr_path, best_score
+
+
+def viterbi_new_loop(dnn_base, emission, transition, labels=None):
+  """
+  原三重循环实现的viterbi_new，作为对照
+  """
+  constraint, _ = CONSTRAINTS[dnn_base.task]
+  length = emission.shape[1]
+  path = np.ones([dnn_base.tags_count, length + 1], dtype=np.int32) * -1
+  corr_path = np.zeros([length], dtype=np.int32)
+  path_score = np.ones([dnn_base.tags_count, length + 1], dtype=np.float64) * (np.finfo('f').min / 2)
+  path_score[0, 0] = 0
+
+  for pos in range(1, length + 1):
+    for path_index in range(dnn_base.tags_count):
+      for curr_label in constraint[path_index]:
+        tmp = path_score[path_index, pos - 1] + emission[curr_label, pos - 1] + transition[path_index, curr_label]
+        if labels is not None:
+          if curr_label != labels[pos - 1]:
+            tmp += dnn_base.hinge_discount
+        if tmp > path_score[curr_label, pos]:
+          path_score[curr_label, pos] = tmp
+          path[curr_label, pos] = path_index
+
+  max_index = np.argmax(path_score[:, -1])
+  corr_path[length - 1] = max_index
+  for i in range(length - 1, 0, -1):
+    max_index = path[max_index][i + 1]
+    corr_path[i - 1] = max_index
+  return corr_path
+
+
 # -*- coding: UTF-8 -*-
 class TestDNNBase(TestCase):
   def setUp(self):
     self.dnn_base = DNNBase()
+    self.rng = np.random.RandomState(1234)
+
+  def random_inputs(self, tags_count, length):
+    emission = self.rng.randn(tags_count, length).astype(np.float32)
+    A = self.rng.randn(tags_count, tags_count).astype(np.float32)
+    init_A = self.rng.randn(tags_count).astype(np.float32)
+    return emission, A, init_A
+
+  def set_task(self, task):
+    self.dnn_base.task = task
+    self.dnn_base.tags_count = len(CONSTRAINTS[task][0])
+
   def test_viterbi(self):
+    self.set_task('cws')
     score = np.arange(10, 170, 10).reshape(4, 4).T
     A = np.array([[1, 1, 0, 0], [0, 0, 1, 1], [0, 0, 1, 1], [1, 1, 0, 0]])
     init_A = np.array([1, 1, 0, 0])
-    labels = np.array([3, 3, 3, 3])
     current_path = self.dnn_base.viterbi(score, A, init_A)
-    print(current_path)
+    correct_path, _ = viterbi_loop(self.dnn_base, score, A, init_A)
+    self.assertTrue(np.all(current_path == correct_path))
+
+  def test_viterbi_same_as_loop(self):
+    for task in ['ner', 'cws']:
+      self.set_task(task)
+      tags_count = self.dnn_base.tags_count
+      for length in [1, 2, 7, 30]:
+        emission, A, init_A = self.random_inputs(tags_count, length)
+        labels = self.rng.randint(0, tags_count, length)
+        for is_constraint in [False, True]:
+          for l in [None, labels]:
+            current_path, current_score = self.dnn_base.viterbi(emission, A, init_A, return_score=True,
+                                                                is_constraint=is_constraint, labels=l)
+            correct_path, correct_score = viterbi_loop(self.dnn_base, emission, A, init_A, is_constraint, l)
+            self.assertTrue(np.all(current_path == correct_path))
+            self.assertEqual(current_score, correct_score)
+
+  def test_viterbi_ties(self):
+    self.set_task('cws')
+    emission = np.zeros([4, 6])
+    A = np.zeros([4, 4])
+    init_A = np.zeros([4])
+    current_path = self.dnn_base.viterbi(emission, A, init_A)
+    correct_path, _ = viterbi_loop(self.dnn_base, emission, A, init_A)
+    self.assertTrue(np.all(current_path == correct_path))
+
+  def test_viterbi_batch(self):
+    for task in ['ner', 'cws']:
+      self.set_task(task)
+      tags_count = self.dnn_base.tags_count
+      batch_length, batch_size = 12, 6
+      emission = self.rng.randn(tags_count, batch_length, batch_size).astype(np.float32)
+      _, A, init_A = self.random_inputs(tags_count, 1)
+      lengths = np.array([12, 1, 5, 7, 12, 2])
+      labels = self.rng.randint(0, tags_count, [batch_size, batch_length])
+      for is_constraint, l in [(False, None), (False, labels), (True, None)]:
+        current_paths, current_scores = self.dnn_base.viterbi_batch(emission, A, init_A, lengths, True,
+                                                                    is_constraint, l)
+        for i, length in enumerate(lengths):
+          correct_path, correct_score = self.dnn_base.viterbi(emission[:, :length, i], A, init_A, True,
+                                                              is_constraint,
+                                                              labels=None if l is None else l[i, :length])
+          self.assertTrue(np.all(current_paths[i, :length] == correct_path))
+          self.assertTrue(np.all(current_paths[i, length:] == 0))
+          self.assertEqual(current_scores[i], correct_score)
+
+  def test_viterbi_batch_ignores_padding(self):
+    self.set_task('cws')
+    emission, A, init_A = self.random_inputs(4, 10)
+    emission = emission[:, :, None]
+    padded = emission.copy()
+    padded[:, 6:, :] = 1000 * self.rng.randn(4, 4, 1)
+    lengths = np.array([6])
+    self.assertTrue(np.all(self.dnn_base.viterbi_batch(emission, A, init_A, lengths) ==
+                           self.dnn_base.viterbi_batch(padded, A, init_A, lengths)))
 
   def test_viterbi_new(self):
+    self.set_task('cws')
     score = np.arange(10, 170, 10).reshape(4, 4).T
     A = np.array([[1, 1, 0, 0], [0, 0, 1, 1], [0, 0, 1, 1], [1, 1, 0, 0]])
     init_A = np.array([1, 1, 0, 0])
     labels = np.array([3,3,3,3])
     current_path = self.dnn_base.viterbi_new(score, A, init_A,labels)
+    self.assertTrue(np.all(current_path == viterbi_new_loop(self.dnn_base, score, A, labels)))
+    for task in ['ner', 'cws']:
+      self.set_task(task)
+      emission, A, init_A = self.random_inputs(self.dnn_base.tags_count, 9)
+      labels = self.rng.randint(0, self.dnn_base.tags_count, 9)
+      for l in [None, labels]:
+        current_path = self.dnn_base.viterbi_new(emission, A, init_A, l)
+        self.assertTrue(np.all(current_path == viterbi_new_loop(self.dnn_base, emission, A, l)))
     #print(current_path)
     #correct_path = np.array([1, 3, 1, 3])
     #correct_score = np.array([21, 102, 203, 364])
     #self.assertTrue(np.all(current_path == correct_path))
     #self.assertTrue(np.all(current_score == correct_score))
 
+  def test_transition_mask(self):
+    transition_mask, init_mask = self.dnn_base.get_transition_mask('ner')
+    self.assertEqual(transition_mask[0, 2], -np.inf)
+    self.assertEqual(init_mask[2], -np.inf)
+    self.assertEqual(np.sum(np.isinf(transition_mask)), 1)
+    self.assertIs(self.dnn_base.get_transition_mask('ner')[0], transition_mask)
+
+    transition_mask, init_mask = self.dnn_base.get_transition_mask('category')
+    labels = dict(zip(self.dnn_base.category_reverse_dict.values(), self.dnn_base.category_reverse_dict.keys()))
+    self.assertEqual(transition_mask.shape, (46, 46))
+    self.assertEqual(transition_mask[labels['SYM_B'], labels['SYM_O']], 0)
+    self.assertEqual(transition_mask[labels['SYM_O'], labels['SYM_O']], 0)
+    self.assertEqual(transition_mask[labels['SYM_O'], labels['PT_B']], 0)
+    self.assertEqual(transition_mask[labels['SYM_B'], labels['PT_O']], -np.inf)
+    self.assertEqual(transition_mask[labels['O'], labels['PT_O']], -np.inf)
+    self.assertEqual(init_mask[labels['PT_O']], -np.inf)
+    self.assertTrue(np.all(np.isinf(transition_mask[:, labels['P']])))
+
+  def test_viterbi_category_constraint(self):
+    self.dnn_base.task = 'category'
+    self.dnn_base.tags_count = len(self.dnn_base.category_reverse_dict)
+    emission, A, init_A = self.random_inputs(self.dnn_base.tags_count, 20)
+    current_path = self.dnn_base.viterbi(emission, A, init_A, is_constraint=True)
+    names = [self.dnn_base.category_reverse_dict[t] for t in current_path]
+    self.assertFalse(names[0].endswith('_O'))
+    for prev, curr in zip(names[:-1], names[1:]):
+      if curr.endswith('_O'):
+        self.assertEqual(prev[:-2], curr[:-2])
+
+  def test_viterbi_beam(self):
+    for task in ['ner', 'cws']:
+      self.set_task(task)
+      emission, A, init_A = self.random_inputs(self.dnn_base.tags_count, 15)
+      labels = self.rng.randint(0, self.dnn_base.tags_count, 15)
+      for is_constraint, l in [(False, None), (True, None), (False, labels)]:
+        current_path, current_score = self.dnn_base.viterbi_beam(emission, A, init_A, self.dnn_base.tags_count,
+                                                                 True, is_constraint, l)
+        correct_path, correct_score = self.dnn_base.viterbi(emission, A, init_A, True, is_constraint, l)
+        self.assertTrue(np.all(current_path == correct_path))
+        self.assertEqual(current_score, correct_score)
+
+  def test_viterbi_beam_batch(self):
+    self.dnn_base.task = 'category'
+    self.dnn_base.tags_count = len(self.dnn_base.category_reverse_dict)
+    tags_count = self.dnn_base.tags_count
+    batch_length, batch_size = 20, 5
+    emission = self.rng.randn(tags_count, batch_length, batch_size)
+    _, A, init_A = self.random_inputs(tags_count, 1)
+    lengths = np.array([20, 1, 7, 13, 20])
+    for is_constraint in [False, True]:
+      paths, scores = self.dnn_base.viterbi_beam_batch(emission, A, init_A, lengths, 4, True, is_constraint)
+      _, exact_scores = self.dnn_base.viterbi_batch(emission, A, init_A, lengths, True, is_constraint)
+      transition = A + self.dnn_base.get_transition_mask()[0] if is_constraint else A
+      init_transition = init_A + self.dnn_base.get_transition_mask()[1] if is_constraint else init_A
+      for i, length in enumerate(lengths):
+        path = paths[i, :length]
+        self.assertTrue(np.all(paths[i, length:] == 0))
+        # 返回的分值为该路径的实际分值，且不超过精确解码的最优分值
+        path_score = init_transition[path[0]] + np.sum(transition[path[:-1], path[1:]]) + \
+                     np.sum(emission[path, np.arange(length), i])
+        self.assertAlmostEqual(scores[i], path_score, 5)
+        self.assertLessEqual(scores[i], exact_scores[i] + 1e-6)
+        single_path, single_score = self.dnn_base.viterbi_beam(emission[:, :length, i], A, init_A, 4, True,
+                                                               is_constraint)
+        self.assertTrue(np.all(single_path == path))
+        self.assertEqual(single_score, scores[i])
+
+  def test_estimate_beam(self):
+    self.dnn_base.task = 'category'
+    self.dnn_base.tags_count = len(self.dnn_base.category_reverse_dict)
+    _, A, init_A = self.random_inputs(self.dnn_base.tags_count, 1)
+    emissions = [self.random_inputs(self.dnn_base.tags_count, length)[0] for length in [1, 5, 20, 40]]
+    self.assertEqual(self.dnn_base.estimate_beam(emissions, A, init_A, self.dnn_base.tags_count, True)[:2], (0, 0))
+    sentence_diff, label_diff, exact_time, beam_time = self.dnn_base.estimate_beam(emissions, A, init_A, 2, True)
+    self.assertTrue(0 <= sentence_diff <= 1 and 0 <= label_diff <= 1)
+    self.assertTrue(exact_time >= 0 and beam_time >= 0)
+    path = self.dnn_base.viterbi_beam(emissions[-1], A, init_A, 4, is_constraint=True)
+    names = [self.dnn_base.category_reverse_dict[t] for t in path]
+    for prev, curr in zip(names[:-1], names[1:]):
+      if curr.endswith('_O'):
+        self.assertEqual(prev[:-2], curr[:-2])
+
   def test_generate_transition_update(self):
     pass
 
   def test_generate_transition_update_index(self):
     pass
 
+  def test_generate_batch_update_index(self):
+    batch_size, batch_length = 5, 9
+    lengths = np.array([9, 1, 4, 6, 3])
+    correct = self.rng.randint(0, 3, [batch_size, batch_length])
+    current = np.where(self.rng.rand(batch_size, batch_length) < 0.6, correct,
+                       self.rng.randint(0, 3, [batch_size, batch_length]))
+    correct[:, 6:] = 3
+    labels_pos, labels_neg, trans_pos, trans_neg, init_pos, init_neg = self.dnn_base.generate_batch_update_index(
+      correct, current, lengths)
+
+    correct_labels_pos, correct_labels_neg = [], []
+    correct_trans_pos, correct_trans_neg = [], []
+    correct_init_pos, correct_init_neg = [], []
+    for i, length in enumerate(lengths):
+      update_index = np.where(correct[i, :length] != current[i, :length])[0]
+      for index in update_index:
+        correct_labels_pos.append([correct[i, index], index, i])
+        correct_labels_neg.append([current[i, index], index, i])
+      if len(update_index) == 0:
+        continue
+      tp, tn, ip, ineg, update_init = self.dnn_base.generate_transition_update_index(correct[i, :length],
+                                                                                    current[i, :length])
+      correct_trans_pos.extend(tp)
+      correct_trans_neg.extend(tn)
+      if update_init:
+        correct_init_pos.append(ip)
+        correct_init_neg.append(ineg)
+
+    self.assertEqual(labels_pos.tolist(), correct_labels_pos)
+    self.assertEqual(labels_neg.tolist(), correct_labels_neg)
+    self.assertEqual(trans_pos.tolist(), correct_trans_pos)
+    self.assertEqual(trans_neg.tolist(), correct_trans_neg)
+    self.assertEqual(init_pos.tolist(), correct_init_pos)
+    self.assertEqual(init_neg.tolist(), correct_init_neg)
+
   def test_sentence2index(self):
     pass
 
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+from dnn_base import DNNBase
+from mlp_tagger import MLPTagger
+from utils import quantize_rows
+
+
+def crf_decode_loop(emission, A, init_A):
+  """
+  逐个标签比较的维特比解码，分值相同时取第一个标签，与tf.contrib.crf.crf_decode一致
+  """
+  tags_count, length = emission.shape
+  score = init_A + emission[:, 0]
+  path = np.zeros([tags_count, length], dtype=np.int32)
+  for pos in range(1, length):
+    new_score = np.empty([tags_count])
+    for t in range(tags_count):
+      best = 0
+      for prev in range(1, tags_count):
+        if score[prev] + A[prev, t] > score[best] + A[best, t]:
+          best = prev
+      path[t, pos] = best
+      new_score[t] = score[best] + A[best, t] + emission[t, pos]
+    score = new_score
+  labels = [int(np.argmax(score))]
+  for pos in range(length - 1, 0, -1):
+    labels.insert(0, path[labels[0], pos])
+  return np.array(labels)
+
+
+class TestMLPTagger(TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.rng = np.random.RandomState(1234)
+    self.words = ['BATCH_PAD', 'UNK', 'BOS', 'EOS'] + list('无明显小便泡沫增多')
+    self.embed_size, self.hidden_units, self.tags_count = 5, 7, 3
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def save_model(self, name='mlp-model.npz', **weights):
+    """
+    按DNN.export_numpy的格式保存随机参数，weights中的参数覆盖随机值
+    """
+    params = {'embeddings': self.rng.randn(len(self.words), self.embed_size),
+              'hidden_w': self.rng.randn(self.hidden_units, 2 * self.embed_size),
+              'hidden_b': self.rng.randn(self.hidden_units, 1),
+              'w': self.rng.randn(self.tags_count, self.hidden_units),
+              'b': self.rng.randn(self.tags_count, 1),
+              'transition': self.rng.randn(self.tags_count, self.tags_count),
+              'transition_init': self.rng.randn(self.tags_count)}
+    params = {key: value.astype(np.float32) for key, value in params.items()}
+    params.update(weights)
+    path = os.path.join(self.folder, name)
+    np.savez(path, task='ner', skip_window_left=0, skip_window_right=1, dict_words=np.array(self.words),
+             dict_indices=np.arange(len(self.words), dtype=np.int32), **params)
+    return path, params
+
+  def reference_scores(self, params, sentence):
+    # 与DNN中MLP计算图相同的前向计算
+    indices = [self.words.index(word) for word in sentence] + [3]
+    seq = np.array([indices[i:i + 2] for i in range(len(sentence))])
+    input_embeds = params['embeddings'][seq].reshape([len(sentence), -1]).T
+    hidden = 1.0 / (1.0 + np.exp(-(np.matmul(params['hidden_w'], input_embeds) + params['hidden_b'])))
+    return np.matmul(params['w'], hidden) + params['b']
+
+  def test_same_as_viterbi(self):
+    path, params = self.save_model()
+    tagger = MLPTagger(path)
+    dnn_base = DNNBase()
+    dnn_base.tags_count = self.tags_count
+    for sentence in ['无明显小便泡沫增多', '多', '泡沫泡沫增多无']:
+      scores = self.reference_scores(params, sentence)
+      self.assertTrue(np.allclose(tagger.word_scores(np.array(tagger.index2seq(tagger.sentence2index(sentence)))),
+                                  scores, atol=1e-5))
+      _, labels = tagger.ner(sentence)
+      correct_labels = dnn_base.viterbi(scores, params['transition'], params['transition_init'], is_first=True)
+      self.assertTrue(np.array_equal(labels, correct_labels))
+      self.assertTrue(np.array_equal(labels, crf_decode_loop(scores, params['transition'],
+                                                             params['transition_init'])))
+
+  def test_ties(self):
+    # 所有分数相同时与crf_decode一样每个位置都取第一个标签
+    zeros = {'w': np.zeros([self.tags_count, self.hidden_units], np.float32),
+             'b': np.zeros([self.tags_count, 1], np.float32),
+             'transition': np.zeros([self.tags_count, self.tags_count], np.float32),
+             'transition_init': np.zeros([self.tags_count], np.float32)}
+    path, params = self.save_model(**zeros)
+    _, labels = MLPTagger(path).ner('无明显小便')
+    self.assertTrue(np.array_equal(labels, crf_decode_loop(np.zeros([self.tags_count, 5]), params['transition'],
+                                                           params['transition_init'])))
+    self.assertTrue(np.all(labels == 0))
+
+  def test_projection_table(self):
+    path, _ = self.save_model()
+    tagger = MLPTagger(path)
+    table_tagger = MLPTagger(path, is_table=True)
+    self.assertEqual(table_tagger.projection_tables.shape, (2, len(self.words), self.hidden_units))
+    for sentence in ['无明显小便泡沫增多', '多']:
+      seq = np.array(tagger.index2seq(tagger.sentence2index(sentence)))
+      # 只有浮点运算顺序不同
+      self.assertTrue(np.allclose(table_tagger.word_scores(seq), tagger.word_scores(seq), atol=1e-5))
+      self.assertTrue(np.array_equal(table_tagger.ner(sentence)[1], tagger.ner(sentence)[1]))
+
+  def test_quantized_projection_table(self):
+    _, params = self.save_model()
+    scales = {}
+    for name in ['embeddings', 'hidden_w', 'w']:
+      params[name], scales[name + '_scale'] = quantize_rows(params[name])
+    path, _ = self.save_model('mlp-quantized.npz', **params, **scales)
+    self.assertTrue(MLPTagger(path).is_quantized)
+    with self.assertRaises(Exception):
+      MLPTagger(path, is_table=True)
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+from config import TrainMode
+from preprocess_data import PreprocessData, RaggedArray
+
+
+def windows_loop(sentence, skip_window_left=0, skip_window_right=1):
+  """
+  原逐字生成窗口的实现，作为向量化实现的对照
+  """
+  extend_words = [2] * skip_window_left
+  extend_words.extend(sentence)
+  extend_words.extend([3] * skip_window_right)
+  return np.array([extend_words[i:i + skip_window_left + skip_window_right + 1] for i in range(len(sentence))],
+                  dtype=np.int32)
+
+
+def object_array(items):
+  array = np.empty([len(items)], dtype=object)
+  array[:] = items
+  return array
+
+
+class TestPreprocessData(TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.folder = tempfile.mkdtemp()
+    os.chdir(self.folder)
+    os.makedirs('corpus/dnn')
+    with open('corpus/test_dict.utf8', 'w', encoding='utf-8') as dict_file:
+      dict_file.write('BATCH_PAD 0\nUNK 1\n')
+    self.sentences = [[5, 6, 7], [8], [9, 10, 11, 12, 13], [14, 15]]
+    self.labels = [[0, 1, 2], [1], [0, 0, 1, 2, 2], [1, 2]]
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.folder)
+
+  def check_sentences(self, character_batches, label_batches, sentences, labels):
+    self.assertEqual(len(character_batches), len(sentences))
+    for character_batch, label_batch, sentence, label in zip(character_batches, label_batches, sentences, labels):
+      self.assertTrue(np.array_equal(character_batch, windows_loop(sentence)))
+      self.assertTrue(np.array_equal(label_batch, label))
+
+  def test_sentence(self):
+    np.save('corpus/test_training_characters', object_array(self.sentences))
+    np.save('corpus/test_training_labels', object_array(self.labels))
+    np.save('corpus/test_training_lengths', np.array([len(s) for s in self.sentences], np.int32))
+    pre = PreprocessData('test', TrainMode.Sentence, mmap=True)
+    self.assertIsInstance(pre.character_batches, RaggedArray)
+    self.assertIsInstance(pre.character_batches.values, np.memmap)
+    self.check_sentences(pre.character_batches, pre.label_batches, self.sentences, self.labels)
+    # 已生成时不再读取原始数据
+    pre = PreprocessData('test', TrainMode.Sentence, force_generate=False)
+    self.assertFalse(hasattr(pre, 'characters'))
+    self.check_sentences(pre.character_batches, pre.label_batches, self.sentences, self.labels)
+
+  def test_batch(self):
+    characters = np.arange(24, dtype=np.int32).reshape([2, 3, 4])
+    labels = characters % 3
+    np.save('corpus/test_training_character_batches', characters)
+    np.save('corpus/test_training_label_batches', labels)
+    np.save('corpus/test_training_lengths_batches', np.full([2, 3], 4, np.int32))
+    pre = PreprocessData('test', TrainMode.Batch, mmap=True)
+    self.assertFalse(pre.is_bucket)
+    self.assertIsInstance(pre.character_batches, np.memmap)
+    self.assertEqual(pre.character_batches.shape, (2, 3, 4, 2))
+    self.check_sentences(pre.character_batches.reshape([6, 4, 2]), pre.label_batches.reshape([6, 4]),
+                         characters.reshape([6, 4]), labels.reshape([6, 4]))
+
+  def test_bucket(self):
+    characters = object_array([np.array([[5, 6], [7, 0]], np.int32), np.array([[8, 9, 10], [11, 12, 0]], np.int32)])
+    labels = object_array([np.array([[1, 2], [1, 0]], np.int32), np.array([[0, 1, 2], [1, 2, 0]], np.int32)])
+    np.save('corpus/test_training_character_batches', characters)
+    np.save('corpus/test_training_label_batches', labels)
+    np.save('corpus/test_training_lengths_batches', np.array([[2, 1], [3, 2]], np.int32))
+    pre = PreprocessData('test', TrainMode.Batch, mmap=True)
+    self.assertTrue(pre.is_bucket)
+    self.assertEqual(len(pre.character_batches), 2)
+    for index in range(2):
+      self.assertEqual(pre.character_batches[index].shape, characters[index].shape + (2,))
+      self.check_sentences(pre.character_batches[index], pre.label_batches[index], characters[index], labels[index])
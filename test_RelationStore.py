@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+from relation_store import save_relation_store, RelationStore
+
+
+class TestRelationStore(TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.base_path = os.path.join(self.folder, 'relations')
+    self.label = np.eye(2, dtype=np.float32)[[0, 1, 1, 0, 1]]
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def test_equal_length(self):
+    sentence = np.arange(20, dtype=np.int32).reshape([5, 4])
+    primary = sentence + 100
+    secondary = sentence + 200
+    save_relation_store(self.base_path, sentence, self.label, primary=primary, secondary=secondary)
+    store = RelationStore(self.base_path)
+    self.assertEqual(len(store), 5)
+    self.assertFalse(store.is_index)
+    batch = store.get_batch(1, 3)
+    self.assertNotIn('length', batch)
+    self.assertTrue(np.array_equal(batch['sentence'], sentence[1:3]))
+    self.assertTrue(np.array_equal(batch['primary'], primary[1:3]))
+    self.assertTrue(np.array_equal(batch['secondary'], secondary[1:3]))
+    self.assertTrue(np.array_equal(batch['label'], self.label[1:3]))
+    # 不足min_length时补齐
+    batch = store.get_batch(0, 2, pad=-1, min_length=6)
+    self.assertTrue(np.array_equal(batch['length'], [4, 4]))
+    self.assertTrue(np.array_equal(batch['sentence'][:, :4], sentence[:2]))
+    self.assertTrue(np.all(batch['sentence'][:, 4:] == -1))
+    self.assertTrue(np.all(batch['primary'][:, 4:] == 0))
+
+  def test_padded_matrix(self):
+    sentence = np.arange(20, dtype=np.int32).reshape([5, 4])
+    lengths = np.array([4, 2, 3, 1, 4], np.int32)
+    save_relation_store(self.base_path, sentence, self.label, lengths, sentence + 100, sentence + 200)
+    store = RelationStore(self.base_path)
+    self.assertTrue(np.array_equal(store.lengths, lengths))
+    batch = store.get_batch(1, 4, pad=-1)
+    self.assertTrue(np.array_equal(batch['length'], [2, 3, 1]))
+    self.assertEqual(batch['sentence'].shape, (3, 3))
+    self.assertTrue(np.array_equal(batch['sentence'], [[4, 5, -1], [8, 9, 10], [12, -1, -1]]))
+    self.assertTrue(np.array_equal(batch['primary'], [[104, 105, 0], [108, 109, 110], [112, 0, 0]]))
+
+  def test_ragged(self):
+    sentences = [np.arange(n, dtype=np.int32) + 10 * n for n in [3, 5, 3, 2, 4]]
+    save_relation_store(self.base_path, sentences, self.label, primary=[s + 100 for s in sentences],
+                        secondary=[s + 200 for s in sentences])
+    store = RelationStore(self.base_path)
+    batch = store.get_batch(0, 2, pad=-1)
+    self.assertTrue(np.array_equal(batch['length'], [3, 5]))
+    self.assertTrue(np.array_equal(batch['sentence'], [[30, 31, 32, -1, -1], [50, 51, 52, 53, 54]]))
+    self.assertTrue(np.array_equal(batch['secondary'], [[230, 231, 232, 0, 0], [250, 251, 252, 253, 254]]))
+    batch = store.get_batch(0, 1)
+    self.assertNotIn('length', batch)
+    self.assertTrue(np.array_equal(batch['primary'], [[130, 131, 132]]))
+
+  def test_ragged_index(self):
+    sentences = [np.arange(n, dtype=np.int32) + 10 * n for n in [3, 5, 3, 2, 4]]
+    primary_index = np.array([0, 1, 2, 0, 3], np.int32)
+    secondary_index = np.array([2, 4, 0, 1, 1], np.int32)
+    save_relation_store(self.base_path, sentences, self.label,
+                        primary_index=primary_index, secondary_index=secondary_index)
+    store = RelationStore(self.base_path)
+    self.assertTrue(store.is_index)
+    self.assertNotIn('primary', store.columns)
+    batch = store.get_batch(0, 2, pad=-1)
+    self.assertTrue(np.array_equal(batch['sentence'], [[30, 31, 32, -1, -1], [50, 51, 52, 53, 54]]))
+    self.assertTrue(np.array_equal(batch['primary_index'], [0, 1]))
+    self.assertTrue(np.array_equal(batch['secondary_index'], [2, 4]))
+    batch = store.get_batch(0, 1)
+    self.assertNotIn('length', batch)
+    self.assertTrue(np.array_equal(batch['sentence'], [[30, 31, 32]]))
+
+  def test_batches(self):
+    sentence = np.arange(20, dtype=np.int32).reshape([5, 4])
+    save_relation_store(self.base_path, sentence, self.label, primary=sentence, secondary=sentence)
+    store = RelationStore(self.base_path)
+    batches = list(store.batches(2))
+    self.assertEqual([len(b['sentence']) for b in batches], [2, 2, 1])
+    self.assertTrue(np.array_equal(np.concatenate([b['sentence'] for b in batches]), sentence))
+    self.assertTrue(np.array_equal(np.concatenate([b['label'] for b in batches]), self.label))
+    batches = list(store.batches(2, drop_remainder=True))
+    self.assertEqual([len(b['sentence']) for b in batches], [2, 2])
+    self.assertTrue(np.array_equal(batches[-1]['sentence'], sentence[2:4]))
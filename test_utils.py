@@ -0,0 +1,92 @@
+from unittest import TestCase
+import numpy as np
+from utils import quantize_rows, dequantize_rows, build_relation_matrices
+
+
+def emr_relation_loop(sentences, primaries, secondaries, batch_length, pad):
+  """
+  原PrepareDataNer中逐个实体对截断或补齐的实现，位置索引在补齐部分继续递增
+  """
+  def extend(column):
+    column = column.tolist()
+    if len(column) > batch_length:
+      return column[:batch_length]
+    return column + list(range(column[-1] + 1, column[-1] + 1 + batch_length - len(column)))
+
+  sentence_matrix = [s.tolist()[:batch_length] + [pad] * (batch_length - len(s)) for s in sentences]
+  return (np.array(sentence_matrix, np.int32), np.array([extend(p) for p in primaries], np.int32),
+          np.array([extend(s) for s in secondaries], np.int32))
+
+
+def semeval_relation_loop(sentences, primary_indices, secondary_indices, batch_length, pad):
+  """
+  原PrepareDataSemeval中逐个实体对补齐的实现，补齐部分的位置索引为pad
+  """
+  sentence_matrix, primary_matrix, secondary_matrix = [], [], []
+  for words, primary, secondary in zip(sentences, primary_indices, secondary_indices):
+    sentence_matrix.append(words.tolist() + [pad] * (batch_length - len(words)))
+    base_index = range(batch_length, len(words) + batch_length)
+    primary_matrix.append([i - primary for i in base_index] + [pad] * (batch_length - len(words)))
+    secondary_matrix.append([i - secondary for i in base_index] + [pad] * (batch_length - len(words)))
+  return (np.array(sentence_matrix, np.int32), np.array(primary_matrix, np.int32),
+          np.array(secondary_matrix, np.int32))
+
+
+class TestUtils(TestCase):
+  def setUp(self):
+    self.rng = np.random.RandomState(1234)
+
+  def random_relations(self, lengths):
+    sentences = [self.rng.randint(4, 100, length).astype(np.int32) for length in lengths]
+    primary_indices = [self.rng.randint(0, length) for length in lengths]
+    secondary_indices = [self.rng.randint(0, length) for length in lengths]
+    return sentences, primary_indices, secondary_indices
+
+  def test_build_relation_matrices_emr(self):
+    batch_length, pad = 12, 0
+    base = batch_length - 1
+    sentences, primary_indices, secondary_indices = self.random_relations([1, 5, 12, 20, 7])
+    # 每个字相对实体的位置索引为base + i - 实体位置
+    primaries = [base - p + np.arange(len(s)) for s, p in zip(sentences, primary_indices)]
+    secondaries = [base - p + np.arange(len(s)) for s, p in zip(sentences, secondary_indices)]
+    matrices = build_relation_matrices(sentences, primary_indices, secondary_indices, batch_length, pad, base)
+    for matrix, correct_matrix in zip(matrices, emr_relation_loop(sentences, primaries, secondaries,
+                                                                  batch_length, pad)):
+      self.assertEqual(matrix.dtype, np.int32)
+      self.assertTrue(np.array_equal(matrix, correct_matrix))
+
+  def test_build_relation_matrices_semeval(self):
+    batch_length, pad = 10, 0
+    sentences, primary_indices, secondary_indices = self.random_relations([1, 4, 10, 6])
+    matrices = build_relation_matrices(sentences, primary_indices, secondary_indices, batch_length, pad,
+                                       batch_length, pad)
+    for matrix, correct_matrix in zip(matrices, semeval_relation_loop(sentences, primary_indices, secondary_indices,
+                                                                      batch_length, pad)):
+      self.assertTrue(np.array_equal(matrix, correct_matrix))
+
+  def test_quantize_rows(self):
+    rng = np.random.RandomState(1234)
+    matrix = rng.randn(6, 10).astype(np.float32) * np.array([[1e-3], [1], [10], [100], [0], [1]], np.float32)
+    matrix[5, 3] = 0
+    quantized, scale = quantize_rows(matrix)
+    self.assertEqual(quantized.dtype, np.int8)
+    self.assertEqual(scale.shape, (6, 1))
+    restored = dequantize_rows(quantized, scale)
+    self.assertEqual(restored.dtype, np.float32)
+    # 每行的误差不超过该行缩放系数的一半
+    error = np.abs(restored - matrix).max(axis=1, keepdims=True)
+    self.assertTrue(np.all(error <= scale / 2 * (1 + 1e-5)))
+    # 全为0的行缩放系数为1，还原后仍为0
+    self.assertEqual(scale[4, 0], 1)
+    self.assertTrue(np.all(quantized[4] == 0))
+    self.assertTrue(np.all(restored[4] == 0))
+    self.assertEqual(restored[5, 3], 0)
+    # 每行绝对值最大的元素量化为±127
+    self.assertTrue(np.all(np.abs(quantized[[0, 1, 2, 3, 5]]).max(axis=1) == 127))
+
+  def test_quantize_rows_shape(self):
+    kernel = np.arange(24, dtype=np.float32).reshape([2, 3, 4]) - 12
+    quantized, scale = quantize_rows(kernel)
+    self.assertEqual(quantized.shape, kernel.shape)
+    self.assertEqual(scale.shape, (2, 1))
+    self.assertTrue(np.allclose(dequantize_rows(quantized, scale), kernel, atol=scale.max() / 2))
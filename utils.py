@@ -1,4 +1,5 @@
 # -*- coding: UTF-8 -*-
+import numpy as np
 import matplotlib.pyplot as plt
 
 
@@ -37,3 +38,87 @@ def plot_lengths(lengths):
   plt.plot(x, count)
   plt.ylabel('长度')
   plt.show()
+
+
+def padding_ratio(lengths, padded_lengths):
+  '''补齐字符占全部字符的比例'''
+  return 1 - sum(lengths) / sum(padded_lengths)
+
+
+def bucket_batches(sentences, labels, batch_size, pad, label_pad, batch_length=None):
+  '''
+  按长度分桶构建batch，句子按长度排序后每batch_size个组成一个batch，每个batch只补齐到其中最长句子的长度
+  :param sentences: 句子中每个字的索引，长度不一的列表
+  :param labels: 每个字对应的标签
+  :param pad: 补齐的字符索引
+  :param label_pad: 补齐的标签
+  :param batch_length: 原固定长度，用于输出补齐比例的对比
+  :return: 每个batch的字符矩阵和标签矩阵（numpy对象数组，每项为batch_size*该batch最大长度），每个句子的长度
+  '''
+  lengths = np.array([len(s) for s in sentences], dtype=np.int32)
+  order = np.argsort(lengths, kind='stable')
+  # 与固定长度的batch一样舍弃不足一个batch的句子，这里舍弃最短的句子
+  order = order[len(order) % batch_size:].reshape([-1, batch_size])
+  character_batches = np.empty([len(order)], dtype=object)
+  label_batches = np.empty([len(order)], dtype=object)
+  for batch_index, indices in enumerate(order):
+    batch_lengths = lengths[indices]
+    mask = np.arange(batch_lengths.max()) < batch_lengths[:, None]
+    character_batch = np.full(mask.shape, pad, dtype=np.int32)
+    label_batch = np.full(mask.shape, label_pad, dtype=np.int32)
+    character_batch[mask] = np.concatenate([sentences[i] for i in indices])
+    label_batch[mask] = np.concatenate([labels[i] for i in indices])
+    character_batches[batch_index] = character_batch
+    label_batches[batch_index] = label_batch
+  batch_lengths = lengths[order]
+
+  padded_lengths = [b.size for b in character_batches]
+  if batch_length is not None:
+    print('padding ratio before: %.4f' % padding_ratio(np.minimum(batch_lengths, batch_length).ravel(),
+                                                       [batch_length * batch_lengths.size]))
+  print('padding ratio after: %.4f' % padding_ratio(batch_lengths.ravel(), padded_lengths))
+  return character_batches, label_batches, batch_lengths
+
+
+def quantize_rows(matrix):
+  '''
+  按行量化为int8，每行使用各自的缩放系数
+  :param matrix: 浮点矩阵，第一维以外的维度视为一行
+  :return: int8矩阵和每行的缩放系数（rows*1）
+  '''
+  rows = matrix.reshape([matrix.shape[0], -1])
+  scale = np.abs(rows).max(axis=1, keepdims=True) / 127
+  scale[scale == 0] = 1
+  quantized = np.round(rows / scale).astype(np.int8).reshape(matrix.shape)
+  return quantized, scale.astype(np.float32)
+
+
+def dequantize_rows(quantized, scale):
+  '''quantize_rows的逆变换'''
+  rows = quantized.reshape([quantized.shape[0], -1]).astype(np.float32) * scale
+  return rows.reshape(quantized.shape)
+
+
+def build_relation_matrices(sentences, primary_indices, secondary_indices, batch_length, pad, base,
+                            position_pad=None):
+  '''
+  一次构建所有实体对补齐后的字索引矩阵和两个相对位置矩阵，超过batch_length的句子截断
+  :param sentences: 每个实体对所在句子的字索引，长度不一的列表
+  :param primary_indices: 第一个实体在句子中的位置
+  :param secondary_indices: 第二个实体在句子中的位置
+  :param pad: 补齐的字索引
+  :param base: 位置索引的基准，第i个字的相对位置为base + i - 实体位置
+  :param position_pad: 补齐位置的位置索引，为None时按相对位置继续递增
+  :return: 字索引矩阵、两个相对位置矩阵，均为count*batch_length
+  '''
+  lengths = np.array([len(s) for s in sentences], dtype=np.int32)
+  mask = np.arange(batch_length) < lengths[:, None]
+  sentence_matrix = np.full(mask.shape, pad, dtype=np.int32)
+  sentence_matrix[mask] = np.concatenate([s[:batch_length] for s in sentences] + [np.zeros([0], np.int32)])
+  positions = np.arange(batch_length) + base
+  primary_matrix = (positions - np.asarray(primary_indices)[:, None]).astype(np.int32)
+  secondary_matrix = (positions - np.asarray(secondary_indices)[:, None]).astype(np.int32)
+  if position_pad is not None:
+    primary_matrix[~mask] = position_pad
+    secondary_matrix[~mask] = position_pad
+  return sentence_matrix, primary_matrix, secondary_matrix